@@ -1,8 +1,14 @@
 import os
 import logging
-from pydub import AudioSegment
-from const import AUDIO_DIR, ALLOWED_EXTENSIONS
+from const import AUDIO_DIR, MEDIA_DIR, ALLOWED_EXTENSIONS, AUDIO_CACHE_BYTES, SIDECAR, SIDECAR_DIR
 from controller import audio_controller
+from scheduler import playback_scheduler, DOORBELL
+from cache import LRUCache, file_key, file_group
+from sidecar import SidecarStore
+from library import AudioLibrary
+from mixer import volume_gain
+from pcm import decode_file, to_output
+from metrics import span
 from io import BytesIO
 
 
@@ -13,8 +19,93 @@ class AudioPlaybackError(Exception):
     pass
 
 
-def play_local_file(filename: str, volume: int, loop: bool, number: int):
-    # Validate filename
+# What a mapped sidecar counts against the cache budget, its samples live
+# in the page cache and not in our heap, but the mapping is held until
+# the entry is evicted
+MAPPED_ENTRY_BYTES = 64 * 1024
+
+
+def _cached_size(audio):
+    if getattr(audio, "mapped", False):
+        return MAPPED_ENTRY_BYTES
+    return len(audio.raw_data)
+
+
+# Decoded audio keyed by path, mtime and size, one version per path
+audio_cache = LRUCache(AUDIO_CACHE_BYTES, sizeof=_cached_size, group=file_group)
+
+sidecar_store = SidecarStore(SIDECAR_DIR)
+
+
+def load_local_file(path: str):
+    try:
+        key = file_key(path)
+    except OSError:
+        # Removed since it was found
+        raise AudioPlaybackError("File not found")
+
+    audio = audio_cache.get(key)
+    if audio is not None:
+        _LOGGER.debug("cache hit %s", path)
+        return audio
+
+    _LOGGER.debug("cache miss %s", path)
+    try:
+        with span("decode"):
+            if SIDECAR:
+                try:
+                    audio = sidecar_store.load(path)
+                except OSError as e:
+                    # e.g. /data not mapped, fall back to decoding in memory
+                    _LOGGER.warning("sidecar unavailable for %s: %s", path, e)
+            if audio is None:
+                audio = decode_file(path)
+    except Exception as e:
+        raise AudioPlaybackError(f"Error decoding audio: {e}")
+
+    audio_cache.put(key, audio)
+    return audio
+
+def store_local_file(path: str, audio):
+    """Cache audio decoded from a file before it was moved to path.
+
+    The sidecar is written from it, the file is not decoded again.
+    """
+    if SIDECAR:
+        try:
+            sidecar_store.transcode(path, audio)
+            audio = sidecar_store.load(path)
+        except OSError as e:
+            _LOGGER.warning("sidecar unavailable for %s: %s", path, e)
+
+    try:
+        key = file_key(path)
+    except OSError:
+        raise AudioPlaybackError("File not found")
+    audio_cache.put(key, audio)
+
+
+def cached_local_file(path: str):
+    """Decoded audio of path if it is in the cache, never decodes."""
+    try:
+        return audio_cache.peek(file_key(path))
+    except OSError:
+        return None
+
+
+def find_local_file(filename: str):
+    # Shipped sounds take precedence over the ones in the media folder
+    for directory in (AUDIO_DIR, MEDIA_DIR):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+audio_library = AudioLibrary({"shipped": AUDIO_DIR, "media": MEDIA_DIR}, cached_local_file)
+
+
+def validate_filename(filename: str):
     if any(x in filename for x in ["..", "/", "\\"]):
         raise AudioPlaybackError("Illegal filename")
 
@@ -22,36 +113,45 @@ def play_local_file(filename: str, volume: int, loop: bool, number: int):
     if ext not in ALLOWED_EXTENSIONS:
         raise AudioPlaybackError("Unsupported file extension")
 
-    path = os.path.join(AUDIO_DIR, filename)
+
+def open_local_file(filename: str):
+    """Decoded audio of a shipped or uploaded sound, by its filename."""
+    with span("validate"):
+        validate_filename(filename)
+        # Files added since the last scan are not indexed yet
+        path = audio_library.find(filename) or find_local_file(filename)
 
     _LOGGER.debug("AUDIO_DIR: %s", path)
 
-    if not os.path.isfile(path):
+    if path is None:
         raise AudioPlaybackError("File not found")
 
-    # Load audio
-    try:
-        audio = AudioSegment.from_file(path)
-    except Exception as e:
-        raise AudioPlaybackError(f"Error decoding audio: {e}")
+    return load_local_file(path)
 
-    # Volume adjustment
-    audio += (volume - 100)
 
-    # Start playback
-    audio_controller.play(audio,loop,number)
+def play_local_file(filename: str, volume: int, loop: bool, number: int, request_class: str=DOORBELL, on_event=None, trace=None):
+    audio = open_local_file(filename)
 
-def play_stream(stream: bytes, volume: int, loop: bool, number: int):
+    return play_audio(audio, volume, loop, number, filename,
+                      request_class=request_class, key=(filename, volume, loop, number), on_event=on_event, trace=trace)
+
+def play_stream(stream: bytes, volume: int, loop: bool, number: int, name: str="", request_class: str=DOORBELL, key=None, on_event=None, trace=None):
     # Validate filename
 
     # Load audio
+    from pydub import AudioSegment
     try:
-        audio = AudioSegment.from_file(BytesIO(stream))
+        with span("decode"):
+            audio = to_output(AudioSegment.from_file(BytesIO(stream)))
     except Exception as e:
         raise AudioPlaybackError(f"Error decoding audio: {e}")
 
-    # Volume adjustment
-    audio += (volume - 100)
+    return play_audio(audio, volume, loop, number, name, request_class=request_class, key=key, on_event=on_event, trace=trace)
+
+def play_audio(audio, volume: int, loop: bool, number: int, name: str="", gap: float=0, request_class: str=DOORBELL, key=None, on_event=None, trace=None):
+    # Volume is a gain stage at playback, the (cached) buffer is played as it is
+    gain = volume_gain(volume)
 
-    # Start playback
-    audio_controller.play(audio,loop,number)
+    # Start playback, returns the scheduler's outcome
+    source = audio_controller.render(audio, loop, number, gap)
+    return playback_scheduler.submit(request_class, source, name, key, gain=gain, on_event=on_event, trace=trace)
@@ -1,135 +1,84 @@
-import math
 import wave
-import struct
-import tempfile
+from io import BytesIO
+from functools import lru_cache
+import numpy as np
+from pcm import PcmBuffer, OUTPUT_RATE, OUTPUT_CHANNELS
 
 
-# Audio will contain a long list of samples (i.e. floating point numbers describing the
-# waveform).  If you were working with a very long sound you'd want to stream this to
-# disk instead of buffering it all in memory list this.  But most sounds will fit in
-# memory.
-#audio = []
-#sample_rate = 44100.0
+@lru_cache(maxsize=64)
+def render_tone(freq: float, duration_milliseconds: float, sample_rate: float, volume: float, channels: int=1) -> bytes:
+    """
+    Render a sine beep followed by half its duration of silence as 16 bit
+    signed samples, the same on every channel. The whole buffer is computed
+    in one go and cached, repeated beeps with the same parameters cost a
+    dictionary lookup.
+    """
+    num_samples = int(duration_milliseconds * (sample_rate / 1000.0))
+    num_silence = int(duration_milliseconds / 2 * (sample_rate / 1000.0))
+
+    samples = np.zeros(num_samples + num_silence, dtype=np.int16)
+
+    # WAV files here are using short, 16 bit, signed integers for the
+    # sample size.  So we multiply the floating point data we have by 32767, the
+    # maximum value for a short integer.
+    t = np.arange(num_samples, dtype=np.float64) / sample_rate
+    samples[:num_samples] = volume * 32767.0 * np.sin(2 * np.pi * freq * t)
+
+    if channels > 1:
+        samples = np.repeat(samples, channels)
+
+    return samples.tobytes()
+
 
 class BeepNoise(object):
 
     def __init__(self, freq :int=880, duration :int=250 ):
         self._freq = freq
         self._duration = duration
-        self._sample_rate = 22050.0
+        # Rendered in the output format, played without conversion
+        self._sample_rate = OUTPUT_RATE
+        self._channels = OUTPUT_CHANNELS
         self._volume = 1.0
-        self._audio = []
+        self._audio = b""
 
     def beep(self):
+        self._audio = render_tone(self._freq, self._duration, self._sample_rate, self._volume, self._channels)
 
-        self._append_sinewave(self._freq, self._duration, self._volume)
-        self._append_silence(self._duration/2)
+        f = BytesIO()
+        self._write_wav(f)
+        return f.getvalue()
 
-        tmp_file_name = tempfile.TemporaryFile(dir=".",suffix=".wav")
+    def pcm(self) -> PcmBuffer:
+        """The beep as raw samples, skips the wav container altogether."""
+        self._audio = render_tone(self._freq, self._duration, self._sample_rate, self._volume, self._channels)
+        return PcmBuffer(self._audio, self._sample_rate, self._channels, 2)
 
-        wav_file=wave.open(tmp_file_name,"w")
+    def _write_wav(self, f):
+        wav_file=wave.open(f,"w")
 
         # wav params
-        nchannels = 1
+        nchannels = self._channels
         sampwidth = 2
 
         # 44100 is the industry standard sample rate - CD quality. If you need to
         # save on file size you can adjust it downwards. The stanard for low quality
         # is 8000 or 8kHz.
-        nframes = len(self._audio)
+        nframes = len(self._audio) // (sampwidth * nchannels)
         comptype = "NONE"
         compname = "not compressed"
         wav_file.setparams((nchannels, sampwidth, self._sample_rate, nframes, comptype, compname))
-
-        # WAV files here are using short, 16 bit, signed integers for the
-        # sample size.  So we multiply the floating point data we have by 32767, the
-        # maximum value for a short integer.  NOTE: It is theortically possible to
-        # use the floating point -1.0 to 1.0 data directly in a WAV file but not
-        # obvious how to do that using the wave module in python.
-        for sample in self._audio:
-            wav_file.writeframes(struct.pack('h', int( sample * 32767.0 )))
-
+        wav_file.writeframes(self._audio)
         wav_file.close()
 
-        wav = None
-
-        with tmp_file_name as f:
-            f.seek(0)
-            wav = f.read()
-
-        return wav
-
-
-
-    def _append_silence(self, duration_milliseconds):
-        """
-        Adding silence is easy - we add zeros to the end of our array
-        """
-        num_samples = duration_milliseconds * (self._sample_rate / 1000.0)
-
-        for x in range(int(num_samples)):
-            self._audio.append(0.0)
-
-        return
-
-
-    def _append_sinewave(self,
-            freq=440.0,
-            duration_milliseconds=500,
-            volume=1.0):
-        """
-        The sine wave generated here is the standard beep.  If you want something
-        more aggresive you could try a square or saw tooth waveform.   Though there
-        are some rather complicated issues with making high quality square and
-        sawtooth waves... which we won't address here :)
-        """
-
-        #global audio # using global variables isn't cool.
-
-        num_samples = duration_milliseconds * (self._sample_rate / 1000.0)
-
-        for x in range(int(num_samples)):
-            self._audio.append(volume * math.sin(2 * math.pi * freq * ( x / self._sample_rate )))
-
-        return
-
-
     def save_wav(self, file_name):
-        # Open up a wav file
-        wav_file=wave.open(file_name,"w")
+        if not self._audio:
+            self._audio = render_tone(self._freq, self._duration, self._sample_rate, self._volume, self._channels)
 
-        # wav params
-        nchannels = 1
-
-        sampwidth = 2
-
-        # 44100 is the industry standard sample rate - CD quality. If you need to
-        # save on file size you can adjust it downwards. The stanard for low quality
-        # is 8000 or 8kHz.
-        nframes = len(self._audio)
-        comptype = "NONE"
-        compname = "not compressed"
-        wav_file.setparams((nchannels, sampwidth, self._sample_rate, nframes, comptype, compname))
-
-        # WAV files here are using short, 16 bit, signed integers for the
-        # sample size.  So we multiply the floating point data we have by 32767, the
-        # maximum value for a short integer.  NOTE: It is theortically possible to
-        # use the floating point -1.0 to 1.0 data directly in a WAV file but not
-        # obvious how to do that using the wave module in python.
-        for sample in self._audio:
-            wav_file.writeframes(struct.pack('h', int( sample * 32767.0 )))
-
-        wav_file.close()
+        with open(file_name, "wb") as f:
+            self._write_wav(f)
 
         return
 
-#append_sinewave(volume=0.25)
-#append_silence()
-#append_sinewave(volume=0.5)
-#append_silence()
-#append_sinewave()
-#save_wav("output.wav")
-
 #beepwav = BeepNoise()
 #wav = beepwav.beep()
 #beepwav.save_wav("test.wav")
@@ -0,0 +1,110 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Byte budgeted LRU cache.
+
+    Entries are evicted least recently used first once the summed size of
+    all entries exceeds max_bytes. Size of an entry is computed by the
+    sizeof callable. With group, keys for which it returns the same value
+    are versions of one thing and only the last one put is kept.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=len, group=None):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.group = group
+        self.groups = {}
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """Value of key without counting a lookup or refreshing it."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Would evict everything else and still not fit
+            _LOGGER.debug("cache: entry %s too large (%d bytes)", key, size)
+            return
+
+        with self.lock:
+            self._remove(key)
+            if self.group is not None:
+                # e.g. the file was edited, its old version is never asked for again
+                stale = self.groups.get(self.group(key))
+                if stale is not None:
+                    self._remove(stale)
+                self.groups[self.group(key)] = key
+
+            self.entries[key] = (value, size)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                old_key = next(iter(self.entries))
+                self._remove(old_key)
+                self.evictions += 1
+                _LOGGER.debug("cache: evicted %s", old_key)
+
+    def _remove(self, key):
+        old = self.entries.pop(key, None)
+        if old is None:
+            return
+        self.bytes -= old[1]
+        if self.group is not None and self.groups.get(self.group(key)) == key:
+            del self.groups[self.group(key)]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.groups.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def file_key(path: str):
+    """Cache key of a file, changes whenever the file is replaced or edited.
+
+    The first element is the file's path, see file_group.
+    """
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def file_group(key):
+    """All versions of a file share the group of their file_key."""
+    return key[0]
@@ -2,6 +2,7 @@ import os
 
 APP_PORT = 5000
 AUDIO_DIR = "audio-files/"
+MEDIA_DIR = os.getenv("MEDIA_DIR", "/media/doorbell")
 ALLOWED_EXTENSIONS = {".mp3",".wav",".ogg"}
 TTS_FILE = "tts.wav"
 BEEP_FILE = "beep.wav"
@@ -12,4 +13,72 @@ PORT      = int(os.getenv("API_PORT", APP_PORT))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "info").upper()
 TTS_LANG  = os.getenv("TTS_LANG", "en-US")
 
+# Threads for blocking request work (decoding, synthesis)
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", 4)))
+
+# Byte budget of the decoded audio cache
+AUDIO_CACHE_BYTES = int(os.getenv("AUDIO_CACHE_MB", 64)) * 1024 * 1024
+
+# Transcode-once raw PCM sidecars, kept in the add-on data mapping
+SIDECAR     = os.getenv("SIDECAR", "true").lower() == "true"
+SIDECAR_DIR = os.getenv("SIDECAR_DIR", "/data/pcm")
+
+# Synthesized TTS messages, small memory tier in front of a disk tier
+TTS_CACHE_DIR          = os.getenv("TTS_CACHE_DIR", "/data/tts")
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_MB", 8)) * 1024 * 1024
+TTS_CACHE_DISK_BYTES   = int(os.getenv("TTS_CACHE_MB", 64)) * 1024 * 1024
+
+# Split long TTS messages into sentences and synthesize them in parallel
+TTS_STREAMING = os.getenv("TTS_STREAMING", "true").lower() == "true"
+TTS_WORKERS   = max(1, int(os.getenv("TTS_WORKERS", 2)))
+
+# Steps of a /sequence are decoded and synthesized in parallel
+SEQUENCE_WORKERS = max(1, int(os.getenv("SEQUENCE_WORKERS", 4)))
+
+# Upper bound of a pre-rendered loop buffer
+LOOP_BUFFER_BYTES = int(os.getenv("LOOP_BUFFER_MB", 16)) * 1024 * 1024
+
+# Every source is converted to this format once when it is loaded, so the
+# output device is never reopened with other parameters (16 bit samples)
+OUTPUT_RATE     = int(os.getenv("OUTPUT_RATE", 44100))
+OUTPUT_CHANNELS = int(os.getenv("OUTPUT_CHANNELS", 2))
+
+# Where audio goes: "stream" keeps one output stream open, "simpleaudio"
+# opens one per sound, "null" discards it in real time and "wav" writes it
+# to OUTPUT_CAPTURE_PATH. The stream is written in periods of
+# OUTPUT_PERIOD_FRAMES and released after OUTPUT_IDLE_TIMEOUT seconds
+# without sound (0 keeps it open)
+OUTPUT_BACKEND       = os.getenv("OUTPUT_BACKEND", "stream")
+OUTPUT_PERIOD_FRAMES = int(os.getenv("OUTPUT_PERIOD_FRAMES", 512))
+OUTPUT_IDLE_TIMEOUT  = float(os.getenv("OUTPUT_IDLE_TIMEOUT", 0))
+OUTPUT_CAPTURE_PATH  = os.getenv("OUTPUT_CAPTURE_PATH", "/data/capture.wav")
+
+# Lower priority sounds are ducked by this many dB while a higher one plays
+DUCK_DB   = float(os.getenv("DUCK_DB", -12))
+DUCK_GAIN = 10 ** (DUCK_DB / 20)
+
+# Playback scheduling: per class policy, coalescing and queue bound
+SCHEDULER_POLICIES = os.getenv("SCHEDULER_POLICIES", "alarm=preempt,doorbell=preempt,tts=mix,ambient=preempt")
+COALESCE_WINDOW    = int(os.getenv("COALESCE_WINDOW_MS", 1000)) / 1000
+QUEUE_SIZE         = int(os.getenv("QUEUE_SIZE", 8))
+
+# Repeated identical requests per endpoint are absorbed within these windows (ms)
+DEBOUNCE_WINDOWS = os.getenv("DEBOUNCE_WINDOWS", "play=2000,loop=2000,beep=500,tts=2000,sequence=2000")
+
+# Streams are decoded while they arrive: playback starts after the first
+# chunk, at most STREAM_BUFFER_CHUNKS chunks are held ahead of playback
+STREAM_FIRST_CHUNK_MS = int(os.getenv("STREAM_FIRST_CHUNK_MS", 250))
+STREAM_CHUNK_MS       = int(os.getenv("STREAM_CHUNK_MS", 1000))
+STREAM_BUFFER_CHUNKS  = max(1, int(os.getenv("STREAM_BUFFER_CHUNKS", 4)))
+
+# Seconds between two scans of the audio folders for added, changed or removed files
+LIBRARY_SCAN_INTERVAL = float(os.getenv("LIBRARY_SCAN_INTERVAL", 5))
+
+# Largest accepted upload of a custom sound
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", 20)) * 1024 * 1024
+
+# Decode the audio library in the background at startup
+WARMUP         = os.getenv("WARMUP", "false").lower() == "true"
+WARMUP_WORKERS = max(1, int(os.getenv("WARMUP_WORKERS", 2)))
+
 HOST = "0.0.0.0"
\ No newline at end of file
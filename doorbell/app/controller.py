@@ -1,85 +1,389 @@
-import simpleaudio as sa
 import threading
+import queue
 import time
 import logging
+from collections import deque, namedtuple
+from const import LOOP_BUFFER_BYTES
+from const import DUCK_GAIN
+from pcm import render_repeats, render_loop
+from mixer import Mixer, Voice, MIX_RATE, PERIOD_FRAMES
+from output import open_output, NullOutput
+from metrics import span, stage_seconds
+from startup import startup_profile
 
 _LOGGER = logging.getLogger(__name__)
 
-class AudioController:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.play_obj = None
-        self.max_duration = 60000 # milliseconds 60000=10min
-        self.thread = None
-        self.audio = None
-        self.running = False
-
-    def play_thread(self,loop,number):
-
-        loop_cnt = 0
-        start_time = time.time()
-        elapsed = 0
-
-        while self.running:
-            play_obj = sa.play_buffer(
-                self.audio.raw_data,
-                num_channels=self.audio.channels,
-                bytes_per_sample=self.audio.sample_width,
-                sample_rate=self.audio.frame_rate
-            )
+# Grace period polled once a buffer should have ended but the device lags
+TAIL_POLL = 0.001 # seconds
+# A queued output gets the next buffer this long before the current one ends
+QUEUE_AHEAD = 0.1 # seconds
 
-            loop_cnt +=1
-            _LOGGER.debug("play elapsed %s", elapsed)
+# Commands understood by the playback worker
+PLAY = "play"         # replace current playback and everything queued
+PREEMPT = "preempt"   # interrupt current playback, keep the queue
+QUEUE = "queue"       # play after everything else
+MIX = "mix"           # play on top of current playback
+STOP = "stop"         # stop current playback and clear the queue
+SCHEDULE = "schedule" # let the scheduler pick one of the above
+WAKE = "wake"         # a chunk the worker is waiting for became ready
 
-            # Wait until playback finishes or force stop
-            while play_obj.is_playing() and self.running:
-                elapsed = (time.time() - start_time) * 1000
-                if elapsed > self.max_duration:
-                    _LOGGER.debug("max runtime reached")
-                    self.running = False
-                time.sleep(0.01)
+Command = namedtuple("Command", ["kind", "item"])
 
-            if not loop and number > 1 and loop_cnt >= number:
-                play_obj.stop()
-                self.running = False
-                break
 
-            if not self.running:
-                play_obj.stop()
-                _LOGGER.debug("stop triggered")
-                break
+class PlaybackItem:
+    """Something to play: an iterable of audio buffers, or of futures
+    resolving to audio buffers for sources that are still being prepared."""
 
-            if not loop and number == 1:
-                # Played once, then exit
-                _LOGGER.debug("normal end")
-                break
+    def __init__(self, source, name: str="", priority: int=0, gain: float=1.0, policy: str=None, on_event=None, trace=None):
+        self.source = source
+        self.name = name
+        self.priority = priority
+        self.gain = gain
+        self.policy = policy
+        self.on_event = on_event
+        self.trace = trace
+        self.created = time.monotonic()
+        self.started = None
 
-        _LOGGER.debug("end play thread")
+    def notify(self, event, error=None):
+        # event is one of start, end, stopped, failed or dropped, error
+        # says what went wrong for failed
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event, error)
+        except Exception as e:
+            _LOGGER.error("%s listener failed: %s", self.name, e)
 
-    def play(self, audio_segment,loop,number):
+    def discard(self):
+        # Stop preparing chunks nobody will play
+        if hasattr(self.source, "close"):
+            self.source.close()
+        self.notify("dropped")
 
-        if self.running:
-            self.running = False
-            self.thread.join()
 
+def repeat(audio, loop, number):
+    # Lazy repetitions of the same buffer, no copies
+    count = 0
+    while loop or count < max(number, 1):
+        yield audio
+        count += 1
+
+
+class AudioController:
+    """Owns the audio output.
 
-        self.audio = audio_segment
+    A single long-lived worker thread plays everything. Callers only put
+    commands into a thread-safe queue and never wait for the worker.
+    Items started with MIX play as additional voices on top of what is
+    already playing, the worker mixes all active voices into one buffer.
+    """
 
-        self.running = True
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.max_duration = 60000 # milliseconds 60000=60s
+        self.commands = queue.Queue()
+        self.pending = deque()
+        self.voices = []
+        self.mixer = Mixer(DUCK_GAIN)
+        # Opened by the worker, opening a device can take a while and
+        # nothing has to wait for it before the first sound
+        self.output = None
+        self.ready = threading.Event()
+        # Handles of buffers handed to the output that may still play and
+        # when the last of them ends
+        self.playing = []
+        self.queued_until = 0.0
+        self.scheduler = None
         self.thread = threading.Thread(
-            target=self.play_thread,
-            args=(loop,number,),
+            target=self._worker,
+            name="playback",
             daemon=True
         )
-        self.thread.start()
+
+    def start(self):
+        """Start the playback worker, which opens the output first.
+
+        Not done on import: the warmup pool's fork server imports the
+        API module and must stay free of threads and open devices.
+        """
+        with self.lock:
+            if self.thread.ident is None:
+                self.thread.start()
+
+    # Worker side
+
+    def _open_output(self):
+        try:
+            with span("device_open"):
+                self.output = open_output()
+        except Exception as e:
+            # Keep the worker and the API alive, requests are accepted
+            # but nothing is heard
+            _LOGGER.error("cannot open the audio output, discarding audio: %s", e)
+            self.output = NullOutput()
+        finally:
+            # Whoever waits for the output must not wait forever
+            self.ready.set()
+        startup_profile.mark("output_open")
+
+    def _worker(self):
+        self._open_output()
+        while True:
+            try:
+                self._update_voices()
+                if not self.voices:
+                    if not self.pending:
+                        # Idle, sleep until somebody wants something
+                        self._handle(self.commands.get())
+                    continue
+                self._play_step()
+            except Exception as e:
+                # Errors of a single voice are handled in _update_voices,
+                # this one hit the playback of all of them
+                _LOGGER.error("playback failed: %s", e)
+                with self.lock:
+                    for voice in self.voices:
+                        voice.fail(e)
+
+    def _wake(self, future):
+        self.commands.put(Command(WAKE, None))
+
+    def _start_voice(self, item):
+        item.started = time.monotonic()
+        stage_seconds.observe("queue", item.started - item.created)
+        _LOGGER.debug("start %s", item.name)
+        self.voices.append(Voice(item))
+        item.notify("start")
+
+    def _close_voices(self):
+        for voice in self.voices:
+            voice.close()
+
+    def _drop_pending(self):
+        for item in self.pending:
+            item.discard()
+        self.pending.clear()
+
+    def _update_voices(self):
+        now = time.monotonic()
+
+        with self.lock:
+            if not self.voices and self.pending:
+                self._start_voice(self.pending.popleft())
+
+        for voice in self.voices:
+            if now >= voice.item.started + self.max_duration / 1000:
+                _LOGGER.debug("max runtime reached")
+                voice.close()
+                continue
+            try:
+                voice.fetch(self._wake)
+            except Exception as e:
+                # e.g. a chunk that failed to decode, the other voices play on
+                _LOGGER.error("%s failed: %s", voice.item.name, e)
+                voice.fail(e)
+
+        with self.lock:
+            for voice in self.voices:
+                if voice.finished:
+                    _LOGGER.debug("end %s", voice.item.name)
+                    if voice.error is not None:
+                        voice.item.notify("failed", str(voice.error))
+                    else:
+                        voice.item.notify("stopped" if voice.stopped else "end")
+            self.voices = [voice for voice in self.voices if not voice.finished]
+
+    def _handle(self, cmd) -> bool:
+        """Apply a command, returns True if the current buffer must be dropped."""
+        with self.lock:
+            if cmd.kind == SCHEDULE:
+                top = max((voice.item.priority for voice in self.voices), default=None)
+                kind = self.scheduler.resolve(cmd.item, top, len(self.pending))
+                if kind is None:
+                    cmd.item.discard()
+                    return False
+                cmd = Command(kind, cmd.item)
+
+            if cmd.kind == PLAY:
+                self._close_voices()
+                self._drop_pending()
+                self._stop_output()
+                self.pending.append(cmd.item)
+                return True
+            if cmd.kind == PREEMPT:
+                self._close_voices()
+                self._stop_output()
+                self.pending.appendleft(cmd.item)
+                return True
+            if cmd.kind == QUEUE:
+                self.pending.append(cmd.item)
+                return False
+            if cmd.kind == MIX:
+                self._start_voice(cmd.item)
+                return True
+            if cmd.kind == STOP:
+                self._close_voices()
+                self._drop_pending()
+                self._stop_output()
+                return True
+            if cmd.kind == WAKE:
+                # Re-render so the voice joins the mix
+                return any(voice.waiting is not None for voice in self.voices)
+        return False
+
+    def _wait_command(self, timeout) -> bool:
+        try:
+            cmd = self.commands.get(timeout=max(0, timeout))
+        except queue.Empty:
+            return False
+        return self._handle(cmd)
+
+    def _play_step(self):
+        deadline = min(voice.item.started for voice in self.voices) + self.max_duration / 1000
+        ready = [voice for voice in self.voices if voice.ready]
+
+        if not ready:
+            # Everything is still being prepared
+            self._wait_command(deadline - time.monotonic())
+            return
+
+        gains = self.mixer.gains(ready)
+        if len(ready) == 1 and gains[0] == 1.0:
+            # Nothing to mix, play the buffer as it is
+            audio = ready[0].tail()
+            frames = ready[0].remaining
+        elif len(ready) == 1 and ready[0].audio.sample_width == 2:
+            # Only a gain stage, applied in the buffer's own format
+            frames = self._period(ready[0].remaining)
+            with span("gain"):
+                audio = self.mixer.scale(ready[0].tail(frames), gains[0])
+        else:
+            # Mix until the first voice runs out of samples
+            frames = self._period(min(voice.remaining for voice in ready))
+            with span("mix"):
+                audio = self.mixer.render(ready, frames)
+
+        if frames == 0:
+            for voice in ready:
+                voice.advance(0)
+            return
+
+        elapsed = self._play_once(audio, deadline, ready)
+        if elapsed is not None:
+            frames = min(frames, int(elapsed * MIX_RATE))
+
+        for voice in ready:
+            voice.advance(frames)
+
+    def _period(self, frames: int) -> int:
+        # A queued output plays periods back to back, the others would
+        # reopen the device for each one and get the whole buffer
+        if self.output.queued:
+            return min(frames, PERIOD_FRAMES)
+        return frames
+
+    def _play_once(self, audio, deadline, voices):
+        """Hand audio to the output and wait until the next buffer is due.
+
+        A queued output gets the next buffer QUEUE_AHEAD before this one
+        ends, so the two play back to back, other outputs once it has
+        ended. Returns the seconds of audio played if it was interrupted.
+        """
+        with span("device_open"):
+            play_obj = self.output.play_buffer(
+                audio.raw_data,
+                num_channels=audio.channels,
+                bytes_per_sample=audio.sample_width,
+                sample_rate=audio.frame_rate
+            )
+
+        for voice in voices:
+            if voice.item.trace is not None:
+                voice.item.trace.audio_written()
+
+        # Starts once everything handed over before it has played
+        start = max(time.monotonic(), self.queued_until)
+        frame_width = audio.channels * audio.sample_width
+        end = start + len(audio.raw_data) / frame_width / audio.frame_rate
+        earlier = [handle for handle in self.playing if handle.is_playing()]
+        self.playing = earlier + [play_obj]
+        self.queued_until = end
+        ahead = QUEUE_AHEAD if self.output.queued else 0
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                self._stop_output()
+                return max(0, now - start)
+
+            # Sleep until the next buffer is due or a command arrives, then
+            # poll briefly in case the device lags behind. Interrupted in
+            # the tail of the buffer before, up to QUEUE_AHEAD of it is lost
+            remaining = end - ahead - now
+            if remaining <= 0:
+                if self.output.queued:
+                    # The next buffer may reuse the memory of the ones
+                    # before this one, they must be done
+                    if not any(handle.is_playing() for handle in earlier):
+                        return None
+                elif not play_obj.is_playing():
+                    return None
+                remaining = TAIL_POLL
+
+            if self._wait_command(min(remaining, deadline - now)):
+                self._stop_output()
+                return max(0, time.monotonic() - start)
+
+    def _stop_output(self):
+        for handle in self.playing:
+            handle.stop()
+        self.playing = []
+        self.queued_until = 0.0
+
+    # Caller side, never blocks on the worker
+
+    def submit(self, kind, source, name="", priority=0, gain=1.0, policy=None, on_event=None, trace=None):
+        self.start()
+        self.commands.put(Command(kind, PlaybackItem(source, name, priority, gain, policy, on_event, trace)))
+
+    def render(self, audio, loop, number, gap=0):
+        """Pre-render loops and repetitions into single buffers.
+
+        A loop is rendered to cover the maximum duration (bounded by
+        LOOP_BUFFER_BYTES) and that buffer is repeated, repetitions are
+        rendered back to back with an exact gap. Either way the output
+        is not reopened between two repetitions.
+        """
+        if loop:
+            return repeat(render_loop(audio, self.max_duration, LOOP_BUFFER_BYTES), True, 1)
+        if number > 1:
+            return [render_repeats(audio, number, gap, self.max_duration, LOOP_BUFFER_BYTES)]
+        return [audio]
 
     def stop(self):
-        self.running = False
+        self.commands.put(Command(STOP, None))
 
     def status(self):
-        if self.running:
-            return True
-        else:
-            return False
+        with self.lock:
+            return bool(self.voices) or bool(self.pending)
+
+    def state(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "state": "playing" if self.voices else "idle",
+                "voices": [
+                    {
+                        "name": voice.item.name,
+                        "priority": voice.item.priority,
+                        "elapsed": round(now - voice.item.started, 3),
+                    }
+                    for voice in self.voices
+                ],
+                "pending": [item.name for item in self.pending],
+                "commands": self.commands.qsize(),
+                "output": self.output.stats() if self.output is not None else None,
+            }
 
 audio_controller = AudioController()
@@ -0,0 +1,70 @@
+import json
+import time
+import threading
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_windows(text: str):
+    """Parse "play=2000,beep=500" (milliseconds) into seconds per endpoint."""
+    windows = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        endpoint, _, window = part.partition("=")
+        windows[endpoint.strip()] = int(window) / 1000
+    return windows
+
+
+class Debouncer:
+    """Absorbs repeated triggers of the same endpoint with the same parameters.
+
+    The first trigger passes, identical ones are suppressed until the
+    window of the endpoint has passed since the last one that passed.
+    Endpoints without a window are never suppressed.
+    """
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.lock = threading.Lock()
+        self.last = {}
+        self.accepted = {}
+        self.suppressed = {}
+
+    def _key(self, endpoint: str, params):
+        return (endpoint, json.dumps(params, sort_keys=True, default=str))
+
+    def accept(self, endpoint: str, params) -> bool:
+        window = self.windows.get(endpoint, 0)
+        key = self._key(endpoint, params)
+        now = time.monotonic()
+
+        with self.lock:
+            if window > 0:
+                # Forget triggers outside their window so the dict stays small
+                self.last = {k: t for k, t in self.last.items() if now - t < self.windows.get(k[0], 0)}
+                if key in self.last:
+                    self.suppressed[endpoint] = self.suppressed.get(endpoint, 0) + 1
+                    _LOGGER.debug("debounce: suppressed %s %s", endpoint, params)
+                    return False
+                self.last[key] = now
+
+            self.accepted[endpoint] = self.accepted.get(endpoint, 0) + 1
+            return True
+
+    def forget(self, endpoint: str, params):
+        """Drop a trigger that passed but was refused, a retry must not be suppressed."""
+        with self.lock:
+            self.last.pop(self._key(endpoint, params), None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                endpoint: {
+                    "window": self.windows.get(endpoint, 0),
+                    "accepted": self.accepted.get(endpoint, 0),
+                    "suppressed": self.suppressed.get(endpoint, 0),
+                }
+                for endpoint in sorted(set(self.windows) | set(self.accepted))
+            }
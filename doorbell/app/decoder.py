@@ -0,0 +1,170 @@
+import threading
+import subprocess
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from const import STREAM_FIRST_CHUNK_MS, STREAM_CHUNK_MS, STREAM_BUFFER_CHUNKS
+from pcm import PcmBuffer, OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH
+
+_LOGGER = logging.getLogger(__name__)
+
+# Read the input from stdin, fed with write()
+PIPE = "pipe:0"
+
+# What ffmpeg may open when it reads from a URL
+URL_PROTOCOLS = "http,https,tcp,tls"
+
+
+def _chunk_bytes(ms: int) -> int:
+    return OUTPUT_RATE * ms // 1000 * OUTPUT_CHANNELS * OUTPUT_WIDTH
+
+
+class StreamDecoder:
+    """Decodes audio while it arrives with one long running ffmpeg.
+
+    ffmpeg reads a URL, or whatever is passed to write(), and writes raw
+    PCM in the output format. A reader thread cuts that into chunks, a
+    short first one so playback starts early and longer ones after it,
+    and keeps at most max_chunks of them. When they are not taken fast
+    enough the reader stops reading, ffmpeg stalls and so does its input,
+    memory stays the same however long the stream is.
+
+    Iterating gives the chunks for the audio controller: a buffer when
+    one is ready, otherwise a future of the next one, which resolves to
+    None at the end of the stream.
+    """
+
+    def __init__(self, source: str=PIPE, first_chunk_ms: int=STREAM_FIRST_CHUNK_MS,
+                 chunk_ms: int=STREAM_CHUNK_MS, max_chunks: int=STREAM_BUFFER_CHUNKS):
+        self.source = source
+        self.first_chunk = _chunk_bytes(first_chunk_ms)
+        self.chunk = _chunk_bytes(chunk_ms)
+        self.max_chunks = max_chunks
+        self.cond = threading.Condition()
+        self.chunks = deque()
+        self.waiting = None
+        self.eof = False
+        self.closed = False
+
+        args = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+        if source != PIPE:
+            args += ["-nostdin", "-protocol_whitelist", URL_PROTOCOLS]
+        args += [
+            "-i", source,
+            "-f", "s16le", "-acodec", "pcm_s16le",
+            "-ar", str(OUTPUT_RATE), "-ac", str(OUTPUT_CHANNELS),
+            "pipe:1"
+        ]
+
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE if source == PIPE else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self.thread = threading.Thread(target=self._read, name="decoder", daemon=True)
+        self.thread.start()
+        # Feeds stdin, writes block for as long as playback is behind
+        self.input = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decoder-input") if source == PIPE else None
+
+    def _read(self):
+        size = self.first_chunk
+        while True:
+            data = self.process.stdout.read(size)
+            if not data:
+                break
+            chunk = PcmBuffer(data, OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH)
+            size = self.chunk
+
+            with self.cond:
+                while len(self.chunks) >= self.max_chunks and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                if self.waiting is not None:
+                    waiting, self.waiting = self.waiting, None
+                    waiting.set_result(chunk)
+                else:
+                    self.chunks.append(chunk)
+
+        returncode = self.process.wait()
+        if returncode and not self.closed:
+            _LOGGER.error("decoder: ffmpeg failed on %s: %s", self.source,
+                          self.process.stderr.read().decode(errors="replace").strip())
+
+        with self.cond:
+            self.eof = True
+            if self.waiting is not None:
+                waiting, self.waiting = self.waiting, None
+                waiting.set_result(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.cond:
+            if self.chunks:
+                self.cond.notify()
+                return self.chunks.popleft()
+            if self.eof:
+                raise StopIteration
+            # Not decoded yet, the controller waits for this one
+            self.waiting = Future()
+            return self.waiting
+
+    def write(self, data: bytes) -> bool:
+        """Feed input to ffmpeg, blocks while the buffered chunks are full.
+
+        Returns False once nobody listens anymore.
+        """
+        if self.closed:
+            return False
+        try:
+            self.process.stdin.write(data)
+            return True
+        except (BrokenPipeError, ValueError):
+            return False
+
+    def finish(self):
+        """End of the input."""
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def feed(self, data: bytes) -> Future:
+        """write() on the decoder's own input thread, a future of its result.
+
+        For callers that must not block, e.g. the event loop, and must
+        not hold a thread of a shared pool while playback catches up.
+        """
+        return self._submit(self.write, data)
+
+    def feed_end(self) -> Future:
+        """finish() on the input thread, after everything fed before."""
+        future = self._submit(self.finish)
+        self.input.shutdown(wait=False)
+        return future
+
+    def _submit(self, func, *args) -> Future:
+        try:
+            return self.input.submit(func, *args)
+        except RuntimeError:
+            # Closed, nobody listens anymore
+            future = Future()
+            future.set_result(False)
+            return future
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.chunks.clear()
+            self.cond.notify_all()
+            if self.waiting is not None:
+                self.waiting.cancel()
+                self.waiting = None
+        if self.process.poll() is None:
+            self.process.kill()
+        if self.input is not None:
+            # Writes still queued fail fast now that ffmpeg is gone
+            self.input.shutdown(wait=False)
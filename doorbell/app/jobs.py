@@ -0,0 +1,84 @@
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+SYNTHESIZING = "synthesizing"
+TRANSCODING = "transcoding"
+RENDERING = "rendering"
+PLAYING = "playing"
+DONE = "done"
+STOPPED = "stopped"
+DROPPED = "dropped"
+COALESCED = "coalesced"
+FAILED = "failed"
+
+FINISHED = {DONE, STOPPED, DROPPED, COALESCED, FAILED}
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.state = QUEUED
+        self.error = None
+        self.created = time.time()
+        self.timings = {}
+
+    def as_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "error": self.error,
+            "created": self.created,
+            # Milliseconds since the job was created
+            "timings": dict(self.timings),
+        }
+
+
+class JobRegistry:
+    """Keeps track of the last max_jobs requests and their progress."""
+
+    def __init__(self, max_jobs: int=100):
+        self.lock = threading.Lock()
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+
+    def create(self, kind: str) -> Job:
+        job = Job(kind)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.as_dict() if job is not None else None
+
+    def update(self, job: Job, state: str, error: str=None):
+        with self.lock:
+            if job.state in FINISHED:
+                return
+            job.state = state
+            job.error = error
+            job.timings[state] = round((time.time() - job.created) * 1000, 1)
+        _LOGGER.debug("job %s (%s): %s", job.id, job.kind, state)
+
+    def listener(self, job: Job):
+        """Playback event callback that moves job along with its playback."""
+        states = {"start": PLAYING, "end": DONE, "stopped": STOPPED, "dropped": DROPPED, "failed": FAILED}
+
+        def on_event(event, error=None):
+            self.update(job, states[event], error)
+        return on_event
+
+
+job_registry = JobRegistry()
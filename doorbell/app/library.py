@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import wave
+import hashlib
+import threading
+import logging
+import subprocess
+import numpy as np
+from const import ALLOWED_EXTENSIONS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def find_audio_files(directory: str):
+    files = []
+    if not os.path.isdir(directory):
+        return files
+    for name in sorted(os.listdir(directory)):
+        _, ext = os.path.splitext(name.lower())
+        path = os.path.join(directory, name)
+        if ext in ALLOWED_EXTENSIONS and os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+# Samples squared per step, a whole file is never converted at once
+RMS_BLOCK_SAMPLES = 65536
+
+
+def probe_duration_ms(path: str):
+    """Duration of path from its header, without decoding it. None if unknown."""
+    try:
+        with wave.open(path, "rb") as f:
+            return f.getnframes() * 1000 // f.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        # Not a plain PCM wav, ask ffprobe
+        pass
+
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            path
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        return int(float(result.stdout) * 1000)
+    except ValueError:
+        return None
+
+
+def loudness_dbfs(audio) -> float:
+    """RMS level of 16 bit audio in dBFS, None for silence."""
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+    if not len(samples):
+        return None
+    total = 0.0
+    for start in range(0, len(samples), RMS_BLOCK_SAMPLES):
+        block = samples[start:start + RMS_BLOCK_SAMPLES].astype(np.float64)
+        total += float(np.dot(block, block))
+    rms = np.sqrt(total / len(samples))
+    if rms == 0:
+        return None
+    return round(float(20 * np.log10(rms / 32768)), 2)
+
+
+class AudioLibrary:
+    """Index of the playable files, kept current by polling their mtimes.
+
+    directories maps a source name ("shipped", "media") to its path,
+    files in earlier directories win over files with the same name in
+    later ones. Everything but duration and loudness is known after a
+    stat. The duration is read from the file's header. Files are never
+    decoded for the index, the loudness is measured when decoded audio is
+    at hand: cached(path) when the file is scanned, or decoded() from
+    whoever decodes it later, e.g. the warmup.
+    """
+
+    def __init__(self, directories, cached):
+        self.directories = directories
+        self.cached = cached
+        self.lock = threading.Lock()
+        # One scan at a time, the watcher and an upload may both ask for one
+        self.scan_lock = threading.Lock()
+        self.entries = {}
+        self.etag = None
+        self.scans = 0
+        self.thread = None
+
+    def start(self, interval: float):
+        self.thread = threading.Thread(
+            target=self._watch,
+            args=(interval,),
+            name="library",
+            daemon=True
+        )
+        self.thread.start()
+
+    def _watch(self, interval: float):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                _LOGGER.error("library: scan failed: %s", e)
+            time.sleep(interval)
+
+    def _stat(self):
+        found = {}
+        for source, directory in self.directories.items():
+            try:
+                paths = find_audio_files(directory)
+            except OSError as e:
+                _LOGGER.warning("library: cannot list %s: %s", directory, e)
+                continue
+            for path in paths:
+                name = os.path.basename(path)
+                if name in found:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found[name] = (path, source, st.st_size, st.st_mtime_ns)
+        return found
+
+    def scan(self):
+        """Update the index, returns True if anything changed."""
+        with self.scan_lock:
+            return self._scan()
+
+    def _scan(self):
+        found = self._stat()
+
+        with self.lock:
+            changed = [
+                name for name, stat in found.items()
+                if name not in self.entries or self.entries[name]["_stat"] != stat
+            ]
+            removed = [name for name in self.entries if name not in found]
+            for name in removed:
+                del self.entries[name]
+            for name in changed:
+                path, source, size, mtime_ns = found[name]
+                _, ext = os.path.splitext(name.lower())
+                self.entries[name] = {
+                    "_stat": found[name],
+                    "filename": name,
+                    "path": path,
+                    "source": source,
+                    "format": ext[1:],
+                    "size": size,
+                    "modified": mtime_ns // 1_000_000_000,
+                    "duration_ms": None,
+                    "loudness_dbfs": None,
+                }
+            if changed or removed:
+                self._update_etag()
+            self.scans += 1
+
+        if changed or removed:
+            _LOGGER.debug("library: %d new or changed, %d removed", len(changed), len(removed))
+
+        for name in changed:
+            self._analyze(name, found[name])
+
+        return bool(changed or removed)
+
+    def _analyze(self, name, stat):
+        path = stat[0]
+        audio = self.cached(path)
+        if audio is not None:
+            self._measure(name, stat, audio)
+            return
+
+        try:
+            duration = probe_duration_ms(path)
+        except OSError as e:
+            _LOGGER.warning("library: cannot analyze %s: %s", name, e)
+            return
+        self._complete(name, stat, {"duration_ms": duration})
+
+    def _measure(self, name, stat, audio):
+        try:
+            details = {"duration_ms": len(audio), "loudness_dbfs": loudness_dbfs(audio)}
+        except Exception as e:
+            _LOGGER.warning("library: cannot analyze %s: %s", name, e)
+            return
+        self._complete(name, stat, details)
+
+    def _complete(self, name, stat, details):
+        with self.lock:
+            entry = self.entries.get(name)
+            # Skip if the file changed again in the meantime
+            if entry is not None and entry["_stat"] == stat:
+                entry.update(details)
+                self._update_etag()
+
+    def decoded(self, path: str, audio):
+        """Complete the entry of path with audio that was just decoded from it."""
+        name = os.path.basename(path)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry["path"] != path or entry["loudness_dbfs"] is not None:
+                return
+            stat = entry["_stat"]
+        self._measure(name, stat, audio)
+
+    def _update_etag(self):
+        listing = json.dumps(self._listing(), sort_keys=True).encode("utf8")
+        self.etag = hashlib.sha1(listing).hexdigest()
+
+    def _listing(self):
+        return [
+            {key: value for key, value in entry.items() if key not in ("_stat", "path")}
+            for _, entry in sorted(self.entries.items())
+        ]
+
+    def find(self, filename: str):
+        """Path of filename, None if it is not in the index (yet)."""
+        with self.lock:
+            entry = self.entries.get(filename)
+            return entry["path"] if entry is not None else None
+
+    def files(self):
+        """The listing and its ETag."""
+        with self.lock:
+            return self._listing(), self.etag
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.entries),
+                "analyzed": sum(1 for entry in self.entries.values() if entry["duration_ms"] is not None),
+                "scans": self.scans,
+            }
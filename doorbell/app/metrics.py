@@ -0,0 +1,116 @@
+import os
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a warm cache hit up to a cold synthesis
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Prometheus histogram with one label, cumulative buckets are built on render."""
+
+    def __init__(self, name: str, help: str, label: str, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value: str, seconds: float):
+        with self.lock:
+            counts, total = self.series.get(value, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.series[value] = (counts, total + seconds)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self.series.items()}
+
+        for value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "doorbell_stage_seconds",
+    "Time spent in each stage between request and playback.",
+    "stage"
+)
+
+first_audio_seconds = Histogram(
+    "doorbell_first_audio_seconds",
+    "Time from the request to its first audio written to the output.",
+    "endpoint"
+)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(stage, time.monotonic() - start)
+
+
+class Trace:
+    """Follows one request to the moment its first audio is written."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.monotonic()
+        self.first_audio = None
+
+    def audio_written(self):
+        # Called by the playback worker for every buffer, only the first counts
+        if self.first_audio is not None:
+            return
+        self.first_audio = time.monotonic() - self.start
+        first_audio_seconds.observe(self.endpoint, self.first_audio)
+        _LOGGER.debug("%s: first audio after %.1f ms", self.endpoint, self.first_audio * 1000)
+
+
+def metric(name: str, kind: str, help: str, samples):
+    """Lines of a gauge or counter, samples maps label strings ("" for none) to values."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples.items():
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+def process_rss() -> int:
+    """Resident set size of the add-on in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def thread_cpu_seconds(thread: threading.Thread) -> float:
+    """CPU time used by thread so far, 0 where /proc is not available."""
+    try:
+        with open(f"/proc/self/task/{thread.native_id}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf("SC_CLK_TCK")
@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+from pcm import PcmBuffer, to_output, OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH
+
+_LOGGER = logging.getLogger(__name__)
+
+# Voices are mixed in the output format, sources normally arrive in it already
+MIX_RATE = OUTPUT_RATE
+MIX_CHANNELS = OUTPUT_CHANNELS
+MIX_WIDTH = OUTPUT_WIDTH
+
+# Samples scaled per step, bounds the float32 scratch buffer
+BLOCK_SAMPLES = 65536
+
+# Longest stretch that is scaled or mixed at once for a queued output, in
+# mix frames. Bounds the output buffers and the work done before a long
+# sound starts, the periods play back to back
+PERIOD_FRAMES = MIX_RATE
+
+
+def volume_gain(volume) -> float:
+    """Linear gain of a volume in percent, 100 is unity and every step is 1 dB."""
+    return 10 ** ((float(volume) - 100) / 20)
+
+
+def to_mix_array(audio) -> np.ndarray:
+    """Samples of audio in the mix format, as a (frames, channels) int16 array.
+
+    Audio that already is in the mix format is wrapped without a copy.
+    """
+    audio = to_output(audio)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, MIX_CHANNELS)
+
+
+class Voice:
+    """One playback item inside the mixer."""
+
+    def __init__(self, item):
+        self.item = item
+        self.source = iter(item.source)
+        self.audio = None
+        self.array = None
+        self.pos = 0          # in mix frames
+        self.waiting = None   # future of the next buffer
+        self.finished = False
+        self.stopped = False
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.audio is not None
+
+    @property
+    def samples(self):
+        if self.array is None:
+            self.array = to_mix_array(self.audio)
+        return self.array
+
+    @property
+    def frames(self):
+        # Length of the current buffer in mix frames, without converting it
+        audio = self.audio
+        frame_width = audio.channels * audio.sample_width
+        return len(audio.raw_data) // frame_width * MIX_RATE // audio.frame_rate
+
+    @property
+    def remaining(self):
+        return max(0, self.frames - self.pos)
+
+    def tail(self, frames: int=None) -> PcmBuffer:
+        """Rest of the current buffer in its own format, without a copy.
+
+        With frames only that many mix frames of it.
+        """
+        audio = self.audio
+        frame_width = audio.channels * audio.sample_width
+        offset = self.pos * audio.frame_rate // MIX_RATE * frame_width
+        end = None
+        if frames is not None:
+            end = (self.pos + frames) * audio.frame_rate // MIX_RATE * frame_width
+        return PcmBuffer(
+            memoryview(audio.raw_data)[offset:end],
+            audio.frame_rate, audio.channels, audio.sample_width
+        )
+
+    def advance(self, frames):
+        self.pos += frames
+        if self.pos >= self.frames:
+            self.audio = None
+            self.array = None
+            self.pos = 0
+
+    def fetch(self, on_ready):
+        """Load the next buffer if the current one is used up.
+
+        Futures that are not done yet leave the voice waiting, on_ready is
+        called once they complete.
+        """
+        while not self.finished and self.audio is None:
+            if self.waiting is not None:
+                if not self.waiting.done():
+                    return
+                element, self.waiting = self.waiting, None
+                self.audio = element.result()
+                continue
+
+            try:
+                element = next(self.source)
+            except StopIteration:
+                self.finished = True
+                return
+
+            if hasattr(element, "add_done_callback"):
+                self.waiting = element
+                element.add_done_callback(on_ready)
+            else:
+                self.audio = element
+
+    def close(self):
+        self.finished = True
+        self.stopped = True
+        # Drop chunks that are still being prepared
+        if hasattr(self.source, "close"):
+            self.source.close()
+
+    def fail(self, error):
+        self.error = error
+        self.close()
+
+
+class Mixer:
+    """Sums voices into one buffer with numpy.
+
+    Every voice has its own gain, voices with a lower priority than the
+    highest active one are ducked by duck_gain. Output is written block
+    by block into two buffers that are reused between renders, so
+    neither gain nor mixing copies the decoded sources.
+    """
+
+    def __init__(self, duck_gain: float):
+        self.duck_gain = duck_gain
+        self._acc = np.zeros(BLOCK_SAMPLES, dtype=np.float32)
+        # Used in turns, the previous buffer may still be playing while
+        # the next one is rendered, the one before it is done
+        self._outs = [np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)]
+        self._turn = 0
+
+    def _output(self, samples: int) -> np.ndarray:
+        if samples > PERIOD_FRAMES * MIX_CHANNELS:
+            # Whole buffers for outputs that do not queue, not kept
+            return np.zeros(samples, dtype=np.int16)
+        self._turn ^= 1
+        if len(self._outs[self._turn]) < samples:
+            self._outs[self._turn] = np.zeros(samples, dtype=np.int16)
+        return self._outs[self._turn][:samples]
+
+    def _store(self, acc, out):
+        np.clip(acc, -32768, 32767, out=acc)
+        np.copyto(out, acc, casting="unsafe")
+
+    def gains(self, voices):
+        top = max(voice.item.priority for voice in voices)
+        return [
+            voice.item.gain * (self.duck_gain if voice.item.priority < top else 1.0)
+            for voice in voices
+        ]
+
+    def scale(self, audio, gain: float) -> PcmBuffer:
+        """16 bit audio with gain applied, in its own format."""
+        samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+        out = self._output(len(samples))
+
+        for start in range(0, len(samples), BLOCK_SAMPLES):
+            block = samples[start:start + BLOCK_SAMPLES]
+            acc = self._acc[:len(block)]
+            np.multiply(block, np.float32(gain), out=acc)
+            self._store(acc, out[start:start + len(block)])
+
+        return PcmBuffer(memoryview(out).cast("B"), audio.frame_rate, audio.channels, audio.sample_width)
+
+    def render(self, voices, frames: int) -> PcmBuffer:
+        gains = [np.float32(gain) for gain in self.gains(voices)]
+        out = self._output(frames * MIX_CHANNELS).reshape(frames, MIX_CHANNELS)
+        block_frames = BLOCK_SAMPLES // MIX_CHANNELS
+
+        for start in range(0, frames, block_frames):
+            count = min(block_frames, frames - start)
+            acc = self._acc[:count * MIX_CHANNELS].reshape(count, MIX_CHANNELS)
+            acc.fill(0)
+            for voice, gain in zip(voices, gains):
+                pos = voice.pos + start
+                chunk = voice.samples[pos:pos + count]
+                acc[:len(chunk)] += chunk * gain
+            self._store(acc, out[start:start + count])
+
+        return PcmBuffer(memoryview(out).cast("B"), MIX_RATE, MIX_CHANNELS, MIX_WIDTH)
@@ -0,0 +1,316 @@
+import time
+import wave
+import threading
+import logging
+from collections import deque
+from const import OUTPUT_BACKEND, OUTPUT_PERIOD_FRAMES, OUTPUT_IDLE_TIMEOUT, OUTPUT_CAPTURE_PATH
+from pcm import OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH
+
+_LOGGER = logging.getLogger(__name__)
+
+# How often an idle stream checks whether it may release the device
+IDLE_CHECK = 1.0 # seconds
+
+# Backends
+SIMPLEAUDIO = "simpleaudio"
+STREAM = "stream"
+NULL = "null"
+WAV = "wav"
+
+
+class OutputBackend:
+    """Where the audio controller sends its buffers.
+
+    play_buffer has the signature of simpleaudio's and returns a handle
+    with is_playing(), stop() and wait_done(). Outputs that are queued
+    play a buffer right after the ones handed to them before, the
+    controller gives them the next buffer before the current one ends.
+    Others play it at once, the controller waits for or stops the
+    previous one first.
+    """
+
+    name = None
+    queued = False
+
+    def __init__(self):
+        self.buffers = 0
+
+    def play_buffer(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name, "buffers": self.buffers}
+
+
+class SimpleAudioOutput(OutputBackend):
+    """Opens a new simpleaudio stream for every buffer."""
+
+    name = SIMPLEAUDIO
+
+    def __init__(self):
+        super().__init__()
+        import simpleaudio
+        self._sa = simpleaudio
+
+    def play_buffer(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        self.buffers += 1
+        return self._sa.play_buffer(audio_data, num_channels, bytes_per_sample, sample_rate)
+
+
+class StreamPlayback:
+    """One buffer handed to the stream, same interface as simpleaudio's PlayObject."""
+
+    def __init__(self, data):
+        self.data = memoryview(data).cast("B")
+        self.pos = 0
+        self.stopped = False
+
+    def is_playing(self):
+        return not self.stopped and self.pos < len(self.data)
+
+    def stop(self):
+        self.stopped = True
+
+    def wait_done(self):
+        while self.is_playing():
+            time.sleep(0.001)
+
+
+class PersistentStream(OutputBackend):
+    """Keeps one output stream open instead of opening a new one per sound.
+
+    PortAudio pulls a period of frames_per_buffer frames at a time from
+    the callback, which hands out the queued buffers one after the other,
+    also within one period, and silence while there is nothing to play.
+    Opening the device is paid once, not on every ring. With
+    idle_timeout > 0 the device is released after that many seconds
+    without sound and opened again by the next buffer.
+    """
+
+    name = STREAM
+    queued = True
+
+    def __init__(self, frame_rate: int, channels: int, frames_per_buffer: int, idle_timeout: float=0):
+        super().__init__()
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.frame_width = channels * OUTPUT_WIDTH
+        self.frames_per_buffer = frames_per_buffer
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # Buffers handed to the stream, the first one is playing
+        self.playbacks = deque()
+        self.last_active = time.monotonic()
+        self.opened = 0
+        self._pa = None
+        self._stream = None
+        self._continue = None
+
+        self._open()
+
+        if idle_timeout > 0:
+            threading.Thread(target=self._watch_idle, name="output-idle", daemon=True).start()
+
+    def _open(self):
+        import pyaudio
+
+        if self._pa is None:
+            self._pa = pyaudio.PyAudio()
+            # Kept so the callback does not look it up every period
+            self._continue = pyaudio.paContinue
+        # Not under the lock, the callback takes it
+        self._stream = self._pa.open(
+            format=self._pa.get_format_from_width(OUTPUT_WIDTH),
+            channels=self.channels,
+            rate=self.frame_rate,
+            output=True,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback
+        )
+        self.opened += 1
+        _LOGGER.debug("output: stream opened, %d frames per period", self.frames_per_buffer)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        size = frame_count * self.frame_width
+        chunks = []
+        missing = size
+        with self.lock:
+            while missing and self.playbacks:
+                playback = self.playbacks[0]
+                if not playback.is_playing():
+                    self.playbacks.popleft()
+                    continue
+                # Copied under the lock, the memory may be reused for
+                # another buffer as soon as this one is done
+                chunk = bytes(playback.data[playback.pos:playback.pos + missing])
+                playback.pos += len(chunk)
+                missing -= len(chunk)
+                chunks.append(chunk)
+            if chunks:
+                self.last_active = time.monotonic()
+
+        if missing:
+            # Nothing (more) to play, keep the device running on silence
+            chunks.append(bytes(missing))
+        return b"".join(chunks), self._continue
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(IDLE_CHECK)
+            with self.lock:
+                idle = not any(playback.is_playing() for playback in self.playbacks)
+                if not idle or time.monotonic() - self.last_active < self.idle_timeout:
+                    continue
+                stream, self._stream = self._stream, None
+
+            if stream is not None:
+                # Waits for a running callback, so never under the lock
+                stream.stop_stream()
+                stream.close()
+                _LOGGER.debug("output: idle, stream released")
+
+    def play_buffer(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        if (sample_rate, num_channels, bytes_per_sample) != (self.frame_rate, self.channels, OUTPUT_WIDTH):
+            raise ValueError(f"Stream plays {self.frame_rate} Hz, {self.channels} channels, got {sample_rate} Hz, {num_channels} channels")
+
+        playback = StreamPlayback(audio_data)
+        with self.lock:
+            # Set first, the idle watcher leaves a stream with sound alone
+            self.playbacks.append(playback)
+            self.last_active = time.monotonic()
+            self.buffers += 1
+
+        if self._stream is None:
+            self._open()
+        return playback
+
+    def close(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+
+    def stats(self):
+        return {**super().stats(), "open": self._stream is not None, "opened": self.opened}
+
+
+class TimedPlayback:
+    """Plays nowhere, but only as fast as a device would."""
+
+    def __init__(self, data, frame_width: int, frame_rate: int, start: float=None):
+        self.data = data
+        self.frame_width = frame_width
+        self.frame_rate = frame_rate
+        self.start = time.monotonic() if start is None else start
+        self.end = self.start + len(data) / frame_width / frame_rate
+
+    def is_playing(self):
+        return time.monotonic() < self.end
+
+    def stop(self):
+        self.end = min(self.end, time.monotonic())
+
+    def wait_done(self):
+        while self.is_playing():
+            time.sleep(0.001)
+
+    def played(self):
+        """The part of data that was played by now."""
+        elapsed = max(0, min(time.monotonic(), self.end) - self.start)
+        frames = min(int(elapsed * self.frame_rate), len(self.data) // self.frame_width)
+        return memoryview(self.data)[:frames * self.frame_width]
+
+
+class NullOutput(OutputBackend):
+    """Discards audio in real time, for machines without a sound device."""
+
+    name = NULL
+    queued = True
+
+    def __init__(self):
+        super().__init__()
+        self.frames = 0
+        self.last = None
+
+    def play_buffer(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        self.buffers += 1
+        self.frames += len(audio_data) // (num_channels * bytes_per_sample)
+        # Starts when the buffers before it are done
+        start = time.monotonic()
+        if self.last is not None:
+            start = max(start, self.last.end)
+        self.last = TimedPlayback(audio_data, num_channels * bytes_per_sample, sample_rate, start)
+        return self.last
+
+    def stats(self):
+        return {**super().stats(), "frames": self.frames}
+
+
+class WavCaptureOutput(NullOutput):
+    """Writes what would have been heard to a WAV file, in real time.
+
+    Buffers are written back to back once they are done or the output is
+    closed, a stopped buffer only as far as it got. Silence between two
+    buffers is not captured.
+    """
+
+    name = WAV
+
+    def __init__(self, path: str, frame_rate: int, channels: int):
+        super().__init__()
+        self.path = path
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.lock = threading.Lock()
+        self.playbacks = deque()
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(OUTPUT_WIDTH)
+        self._wav.setframerate(frame_rate)
+
+    def _flush(self, everything: bool=False):
+        while self.playbacks and (everything or not self.playbacks[0].is_playing()):
+            self._wav.writeframes(self.playbacks.popleft().played())
+
+    def play_buffer(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        if (sample_rate, num_channels, bytes_per_sample) != (self.frame_rate, self.channels, OUTPUT_WIDTH):
+            raise ValueError(f"Capture is {self.frame_rate} Hz, {self.channels} channels, got {sample_rate} Hz, {num_channels} channels")
+
+        # The mixer reuses its output buffers, keep our own copy until it is written
+        playback = super().play_buffer(bytes(audio_data), num_channels, bytes_per_sample, sample_rate)
+        with self.lock:
+            self._flush()
+            self.playbacks.append(playback)
+        return playback
+
+    def close(self):
+        with self.lock:
+            self._flush(everything=True)
+            self._wav.close()
+
+    def stats(self):
+        return {**super().stats(), "path": self.path}
+
+
+def open_output(backend: str=OUTPUT_BACKEND) -> OutputBackend:
+    """The output used by the audio controller."""
+    if backend == NULL:
+        return NullOutput()
+    if backend == WAV:
+        try:
+            return WavCaptureOutput(OUTPUT_CAPTURE_PATH, OUTPUT_RATE, OUTPUT_CHANNELS)
+        except OSError as e:
+            _LOGGER.warning("output: cannot capture to %s, discarding audio: %s", OUTPUT_CAPTURE_PATH, e)
+            return NullOutput()
+    if backend == STREAM:
+        try:
+            return PersistentStream(OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_PERIOD_FRAMES, OUTPUT_IDLE_TIMEOUT)
+        except Exception as e:
+            # e.g. no pyaudio or no device yet, one stream per sound still works
+            _LOGGER.warning("output: persistent stream unavailable, using simpleaudio: %s", e)
+    elif backend != SIMPLEAUDIO:
+        _LOGGER.warning("output: unknown backend %s, using simpleaudio", backend)
+    return SimpleAudioOutput()
@@ -0,0 +1,155 @@
+import math
+import subprocess
+from const import OUTPUT_RATE, OUTPUT_CHANNELS
+
+# The format everything is played in
+OUTPUT_WIDTH = 2
+OUTPUT_FORMAT = (OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH)
+
+
+class PcmBuffer:
+    """Raw interleaved PCM plus its format.
+
+    Has the same raw_data, frame_rate, channels and sample_width attributes
+    as pydub's AudioSegment so both can be handed to the audio controller.
+    raw_data can be any buffer, e.g. a memoryview of a mapped sidecar file.
+    """
+
+    def __init__(self, raw_data, frame_rate: int, channels: int, sample_width: int, mapped: bool=False):
+        self.raw_data = raw_data
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.mapped = mapped
+
+    @classmethod
+    def from_segment(cls, audio):
+        return cls(audio.raw_data, audio.frame_rate, audio.channels, audio.sample_width)
+
+    def to_segment(self):
+        # pydub is imported on first use, it is not needed to start up
+        from pydub import AudioSegment
+        return AudioSegment(
+            data=bytes(self.raw_data),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels
+        )
+
+    @property
+    def frame_width(self):
+        return self.channels * self.sample_width
+
+    @property
+    def frame_count(self):
+        return len(self.raw_data) // self.frame_width
+
+    @property
+    def duration_ms(self):
+        return self.frame_count * 1000.0 / self.frame_rate
+
+    def __len__(self):
+        # Duration in milliseconds, same as AudioSegment
+        return int(self.duration_ms)
+
+
+def is_output_format(audio) -> bool:
+    return (audio.frame_rate, audio.channels, audio.sample_width) == OUTPUT_FORMAT
+
+
+def to_output(audio):
+    """audio converted to the output format, or audio itself if it already is."""
+    if is_output_format(audio):
+        return audio
+    segment = audio.to_segment() if isinstance(audio, PcmBuffer) else audio
+    return segment.set_sample_width(OUTPUT_WIDTH).set_frame_rate(OUTPUT_RATE).set_channels(OUTPUT_CHANNELS)
+
+
+def decode_file(path: str) -> PcmBuffer:
+    """Decode path straight into the output format.
+
+    ffmpeg resamples and remixes while decoding and writes raw samples, the
+    same way the stream decoder does, so nothing is converted afterwards.
+    """
+    result = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", path,
+            "-f", "s16le", "-acodec", "pcm_s16le",
+            "-ar", str(OUTPUT_RATE), "-ac", str(OUTPUT_CHANNELS),
+            "pipe:1"
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode:
+        raise RuntimeError(f"ffmpeg failed on {path}: {result.stderr.decode(errors='replace').strip()}")
+    return PcmBuffer(result.stdout, OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH)
+
+
+def render_repeats(audio, count: int, gap_ms: float=0, duration_ms: float=None, max_bytes: int=None) -> PcmBuffer:
+    """Render count repetitions of audio into one buffer.
+
+    Repetitions are separated by exactly gap_ms of silence (rounded to whole
+    frames), so the timing does not depend on the scheduler. Repetitions
+    that would start after duration_ms or not fit into max_bytes are left
+    out, the first one is always rendered.
+    """
+    frame_width = audio.channels * audio.sample_width
+    size = len(audio.raw_data)
+
+    if duration_ms is not None:
+        period_ms = size / frame_width * 1000.0 / audio.frame_rate + max(gap_ms, 0)
+        if period_ms > 0:
+            count = min(count, max(1, math.ceil(duration_ms / period_ms)))
+
+    # Only rendered between repetitions, a single one needs no gap
+    gap = bytes(int(gap_ms * audio.frame_rate / 1000) * frame_width) if count > 1 else b""
+
+    if max_bytes is not None:
+        count = min(count, max(1, (max_bytes + len(gap)) // max(size + len(gap), 1)))
+
+    data = bytes(audio.raw_data)
+    if gap:
+        data = (data + gap) * (count - 1) + data
+    else:
+        data = data * count
+
+    return PcmBuffer(data, audio.frame_rate, audio.channels, audio.sample_width)
+
+
+def silence(duration_ms: float) -> PcmBuffer:
+    """duration_ms of silence in the output format, rounded to whole frames."""
+    frames = int(duration_ms * OUTPUT_RATE / 1000)
+    return PcmBuffer(bytes(frames * OUTPUT_CHANNELS * OUTPUT_WIDTH), OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH)
+
+
+def concatenate(parts, max_bytes: int=None) -> PcmBuffer:
+    """parts back to back in one buffer in the output format.
+
+    With max_bytes the result is cut there, parts after that are left out.
+    """
+    chunks = []
+    size = 0
+    for part in parts:
+        if max_bytes is not None and size >= max_bytes:
+            break
+        data = memoryview(to_output(part).raw_data).cast("B")
+        if max_bytes is not None:
+            data = data[:max_bytes - size]
+        chunks.append(data)
+        size += len(data)
+    return PcmBuffer(b"".join(chunks), OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH)
+
+
+def render_loop(audio, duration_ms: float, max_bytes: int) -> PcmBuffer:
+    """Render enough repetitions of audio to cover duration_ms, bounded by max_bytes."""
+    size = max(len(audio.raw_data), 1)
+    frame_width = audio.channels * audio.sample_width
+    length_ms = size / frame_width * 1000.0 / audio.frame_rate
+
+    count = max(1, math.ceil(duration_ms / length_ms))
+    count = max(1, min(count, max_bytes // size))
+
+    return render_repeats(audio, count)
@@ -27,8 +27,10 @@ VOICES = [ 'de-DE', 'en-GB', 'en-US', 'es-ES', 'fr-FR', 'it-IT' ]
 class PicoTTS(object):
 
     def __init__(self,
-                 voice       = 'en-US'):
+                 voice       = 'en-US',
+                 cache       = None):
         self._voice       = voice
+        self._cache       = cache
 
     def _picotts_exe(self, args, sync=False):
         cmd = ['pico2wave',
@@ -59,6 +61,21 @@ class PicoTTS(object):
 
     def synth_wav(self, txt):
 
+        if self._cache is not None:
+            wav = self._cache.get(txt, self._voice)
+            if wav is not None:
+                logging.debug('picotts: cache hit, %d bytes.' % len(wav))
+                return wav
+
+        wav = self._synth_wav(txt)
+
+        if self._cache is not None and wav:
+            self._cache.put(txt, self._voice, wav)
+
+        return wav
+
+    def _synth_wav(self, txt):
+
         wav = None
 
         with tempfile.NamedTemporaryFile(suffix='.wav') as f:
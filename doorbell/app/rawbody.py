@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Where the endpoint finds the body in request.scope
+RAW_BODY = "doorbell.raw_body"
+
+
+class RawBody:
+    """Body of a request read straight from the ASGI receive.
+
+    Iterating gives the chunks as the server received them. Nothing is
+    read ahead, while the endpoint does not ask for the next chunk the
+    server stops reading from the socket and the client has to wait.
+    """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self.disconnected = asyncio.Event()
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected.set()
+                return
+            chunk = message.get("body", b"")
+            if chunk:
+                yield chunk
+            if not message.get("more_body", False):
+                return
+
+
+def _is_json(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.split(b";")[0].strip().lower() == b"application/json"
+    return False
+
+
+class RawBodyMiddleware:
+    """Leaves the audio body of requests to paths to their endpoint.
+
+    Quart takes the whole body off the server as fast as it arrives and
+    refuses it once MAX_CONTENT_LENGTH is buffered, which ends a stream
+    that is played slower than it is sent. For these requests Quart sees
+    an empty body, the endpoint reads the real one from
+    request.scope[RAW_BODY] at its own pace and without a size limit.
+    JSON bodies are left to Quart.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths or _is_json(scope):
+            await self.app(scope, receive, send)
+            return
+
+        body = RawBody(receive)
+        started = False
+
+        async def app_receive():
+            nonlocal started
+            if not started:
+                started = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Quart waits here for the client to go away, which only the
+            # reader of the real body can see
+            await body.disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        await self.app({**scope, RAW_BODY: body}, app_receive, send)
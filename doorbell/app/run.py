@@ -1,19 +1,45 @@
 import logging
 import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-from const import LOG_LEVEL, HOST, PORT, ADDON_SLUG, TTS_LANG
+from startup import startup_profile, IMPORTS, SERVING, PLAYABLE
+from const import LOG_LEVEL, HOST, PORT, ADDON_SLUG, TTS_LANG, WARMUP, WARMUP_WORKERS
+from const import TTS_CACHE_DIR, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DISK_BYTES, TTS_STREAMING
+from const import DEBOUNCE_WINDOWS, API_WORKERS, AUDIO_DIR, MEDIA_DIR, UPLOAD_MAX_BYTES, LIBRARY_SCAN_INTERVAL
 
-from flask import Flask, request, jsonify
-#from flask_cors import CORS
-from waitress import serve
-from audio import play_local_file, AudioPlaybackError, play_stream
+if __name__ == "__main__":
+    # Open the port before the heavy imports, early connections wait in
+    # the backlog until hypercorn takes over the socket
+    listen_fd = startup_profile.listen(HOST, PORT)
+
+from quart import Quart, Response, request, jsonify, g, make_response
+from hypercorn.config import Config
+from hypercorn.asyncio import serve
+from audio import play_local_file, AudioPlaybackError, play_stream, play_audio, audio_cache
+from audio import validate_filename, store_local_file, audio_library
 from controller import audio_controller
-from pico2wave import PicoTTS
+from scheduler import playback_scheduler, PRIORITIES, DOORBELL, TTS, AMBIENT
 from beepnoise import BeepNoise
+from warmup import warmup
+from tts_cache import TtsCache
+from debounce import Debouncer, parse_windows
+from jobs import job_registry, SYNTHESIZING, TRANSCODING, RENDERING, DONE, COALESCED, FAILED
+from mixer import volume_gain
+from rawbody import RawBodyMiddleware, RAW_BODY
+from pcm import decode_file
+from metrics import Trace, span, stage_seconds, first_audio_seconds, metric, process_rss, thread_cpu_seconds, CONTENT_TYPE
+import json
+import math
 import wave
 import socket
+import tempfile
+from urllib.parse import urlparse
 from io import BytesIO
 
+startup_profile.mark(IMPORTS)
+
 
 
 #logging.basicConfig(level=logging.INFO)
@@ -21,13 +47,88 @@ logging.basicConfig(level=LOG_LEVEL)
 
 _LOGGER = logging.getLogger(__name__)
 
-app = Flask(__name__)
-#CORS(app)
+app = Quart(__name__)
+# Quart refuses larger bodies with 413 while they stream in
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+# A streamed body is read while it plays, however long it is
+app.asgi_app = RawBodyMiddleware(app.asgi_app, ["/stream"])
+
+# Decoding and synthesis block, they run here and never on the event loop
+executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api")
+
+async def offload(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+tts_cache = TtsCache(TTS_CACHE_DIR, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DISK_BYTES)
+
+debouncer = Debouncer(parse_windows(DEBOUNCE_WINDOWS))
+
+@app.before_serving
+async def serving():
+    startup_profile.mark(SERVING)
+
+def prepare_first_sound():
+    # A ring needs the beep rendered and the output open, both happen
+    # once at startup instead of on the first ring
+    BeepNoise().pcm()
+    audio_controller.ready.wait()
+    startup_profile.mark(PLAYABLE)
+
+def traced(endpoint):
+    # Times the request from here to its first audio, views find it in g.trace
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            g.trace = Trace(endpoint)
+            with span("parse"):
+                await request.get_json(force=True, silent=True)
+            return await view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def debounced(endpoint):
+    # Answer repeated identical triggers right away, before any decoding
+    # or synthesis happens and before they reach the audio controller
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            data = await request.get_json(force=True, silent=True)
+            if data is None:
+                return await view(*args, **kwargs)
+            if not debouncer.accept(endpoint, data):
+                # Already finished, so clients that wait for the job are
+                # answered at once
+                job = job_registry.create(endpoint)
+                job_registry.update(job, COALESCED)
+                return jsonify({"status": "debounced", "job_id": job.id})
+
+            # Only accepted requests hold back the ones that follow, an
+            # invalid one is answered with its error again
+            try:
+                response = await make_response(await view(*args, **kwargs))
+            except BaseException:
+                debouncer.forget(endpoint, data)
+                raise
+            if response.status_code >= 300:
+                debouncer.forget(endpoint, data)
+            return response
+        return wrapper
+    return decorator
+
+def request_class(data, default):
+    # Optional "priority" in the payload overrides the endpoint's default class
+    cls = data.get("priority", default)
+    if cls not in PRIORITIES:
+        return None
+    return cls
 
 @app.route("/tts", methods=["POST"])
-def tts():
+@traced("tts")
+@debounced("tts")
+async def tts():
     try:
-        data = request.get_json(force=True)
+        data = await request.get_json(force=True)
         if data is None:
             _LOGGER.debug("Invalid content type or empty payload")
             return jsonify({"error": "Invalid content type or empty payload"}), 400
@@ -42,27 +143,56 @@ def tts():
     number = 1
     loop = False
 
-    picotts = PicoTTS()
-    picotts.voice = "de-DE"
-    picotts.voice = TTS_LANG
-    wavs = picotts.synth_wav(message)
-    wav = wave.open(BytesIO(wavs))
-    _LOGGER.debug("tts voices: %s",picotts.voices)
-    _LOGGER.debug("tts channels: %s", wav.getnchannels())
-    _LOGGER.debug("tts framerate: %s", wav.getframerate())
-    _LOGGER.debug("tts frames: %s", wav.getnframes())
+    cls = request_class(data, TTS)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
+    job = job_registry.create("tts")
+
+    if data.get("stream", TTS_STREAMING):
+        # Start playing the first sentence while the rest is synthesized
+        job_registry.update(job, SYNTHESIZING)
+        from tts import stream_message
+        chunks = stream_message(message, TTS_LANG, tts_cache)
+        result = playback_scheduler.submit(cls, chunks, "tts", key=(message, volume),
+                                           gain=volume_gain(volume), on_event=job_registry.listener(job),
+                                           trace=g.trace)
+        if result == COALESCED:
+            job_registry.update(job, COALESCED)
+    else:
+        # Synthesize in the background, progress is available at /jobs/<id>
+        executor.submit(tts_job, job, message, volume, cls, g.trace)
 
+    return jsonify({"status": "accepted", "message": message, "job_id": job.id}), 202
+
+def tts_job(job, message, volume, cls, trace=None):
+    job_registry.update(job, SYNTHESIZING)
     try:
-        play_stream(wavs, volume, False, 1)
-        return jsonify({"status": "playing", "message": message})
-    except AudioPlaybackError as e:
-    #except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        from pico2wave import PicoTTS
+        picotts = PicoTTS(cache=tts_cache)
+        picotts.voice = TTS_LANG
+        with span("synthesis"):
+            wavs = picotts.synth_wav(message)
+        wav = wave.open(BytesIO(wavs))
+        _LOGGER.debug("tts voices: %s",picotts.voices)
+        _LOGGER.debug("tts channels: %s", wav.getnchannels())
+        _LOGGER.debug("tts framerate: %s", wav.getframerate())
+        _LOGGER.debug("tts frames: %s", wav.getnframes())
+
+        result = play_stream(wavs, volume, False, 1, "tts", cls, key=(message, volume),
+                             on_event=job_registry.listener(job), trace=trace)
+        if result == COALESCED:
+            job_registry.update(job, COALESCED)
+    except Exception as e:
+        _LOGGER.error("tts job %s failed: %s", job.id, e)
+        job_registry.update(job, FAILED, str(e))
 
 @app.route("/beep", methods=["POST"])
-def beep():
+@traced("beep")
+@debounced("beep")
+async def beep():
     try:
-        data = request.get_json(force=True)
+        data = await request.get_json(force=True)
         if data is None:
             _LOGGER.debug("Invalid content type or empty payload")
             return jsonify({"error": "Invalid content type or empty payload"}), 400
@@ -74,30 +204,92 @@ def beep():
 
     _LOGGER.debug("beep data: %s", data)
 
-    number = data.get("number",1)
+    try:
+        number = int(data.get("number", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid 'number'"}), 400
+    if number < 1:
+        return jsonify({"error": "'number' must be at least 1"}), 400
+
+    try:
+        # Silence between two beeps in milliseconds, on top of the beep's own pause
+        gap = float(data.get("gap", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid 'gap'"}), 400
+    if not (gap >= 0 and math.isfinite(gap)):
+        return jsonify({"error": "'gap' must be a non-negative number of milliseconds"}), 400
+
     volume = data.get("volume", 100)
 
+    cls = request_class(data, DOORBELL)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
     beepwav = BeepNoise()
-    wav = beepwav.beep()
+    beep_pcm = beepwav.pcm()
 
-    if wav == None:
-        _LOGGER.debug("beep wav is empty!!!")
+    try:
+        result = await offload(play_audio, beep_pcm, volume, False, number, "beep", gap,
+                               request_class=cls, key=(number, volume, gap), trace=g.trace)
+        return jsonify({"status": result, "number": number})
+    except AudioPlaybackError as e:
+    #except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
-    #_LOGGER.debug("beep channels: %s", wav.getnchannels())
-    #_LOGGER.debug("beep framerate: %s", wav.getframerate())
-    #_LOGGER.debug("beep frames: %s", wav.getnframes())
+@app.route("/sequence", methods=["POST"])
+@traced("sequence")
+@debounced("sequence")
+async def sequence():
+    try:
+        data = await request.get_json(force=True)
+        if data is None:
+            _LOGGER.debug("Invalid content type or empty payload")
+            return jsonify({"error": "Invalid content type or empty payload"}), 400
+        if not data or "steps" not in data:
+            _LOGGER.debug("Missing parameter 'steps'")
+            return jsonify({"error": "Missing 'steps'"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
+    from sequence import parse_steps
     try:
-        play_stream(wav, volume, False, number)
-        return jsonify({"status": "playing", "number": number})
+        with span("validate"):
+            steps = parse_steps(data["steps"])
     except AudioPlaybackError as e:
-    #except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+    volume = data.get("volume", 100)
+
+    cls = request_class(data, DOORBELL)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
+    # Decoding and synthesis can take a while, progress is available at /jobs/<id>
+    job = job_registry.create("sequence")
+    executor.submit(sequence_job, job, steps, volume, cls, g.trace)
+
+    return jsonify({"status": "accepted", "steps": len(steps), "job_id": job.id}), 202
+
+def sequence_job(job, steps, volume, cls, trace=None):
+    from sequence import render_sequence
+    job_registry.update(job, RENDERING)
+    try:
+        audio = render_sequence(steps, tts_cache)
+        key = json.dumps([steps, volume], sort_keys=True)
+        result = play_audio(audio, volume, False, 1, "sequence", request_class=cls, key=key,
+                            on_event=job_registry.listener(job), trace=trace)
+        if result == COALESCED:
+            job_registry.update(job, COALESCED)
+    except Exception as e:
+        _LOGGER.error("sequence job %s failed: %s", job.id, e)
+        job_registry.update(job, FAILED, str(e))
+
 @app.route("/loop", methods=["POST"])
-def loop():
+@traced("loop")
+@debounced("loop")
+async def loop():
     try:
-        data = request.get_json(force=True)
+        data = await request.get_json(force=True)
         if data is None:
             _LOGGER.debug("Invalid content type or empty payload")
             return jsonify({"error": "Invalid content type or empty payload"}), 400
@@ -113,17 +305,23 @@ def loop():
     _LOGGER.debug("loop filename %s", filename)
     _LOGGER.debug("loop volume %s", volume)
 
+    cls = request_class(data, AMBIENT)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
     try:
-        play_local_file(filename, volume, True, 1)
-        return jsonify({"status": "playing", "filename": filename})
+        result = await offload(play_local_file, filename, volume, True, 1, cls, trace=g.trace)
+        return jsonify({"status": result, "filename": filename})
     except AudioPlaybackError as e:
     #except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route("/play", methods=["POST"])
-def play():
+@traced("play")
+@debounced("play")
+async def play():
     try:
-        data = request.get_json(force=True)
+        data = await request.get_json(force=True)
         if data is None:
             _LOGGER.debug("Invalid content type or empty payload")
             return jsonify({"error": "Invalid content type or empty payload"}), 400
@@ -138,39 +336,243 @@ def play():
     _LOGGER.debug("play filename %s", filename)
     _LOGGER.debug("play volume %s", volume)
 
+    cls = request_class(data, DOORBELL)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
+    job = job_registry.create("play")
+
     try:
-        play_local_file(filename, volume, False, 1)
-        return jsonify({"status": "playing", "filename": filename})
+        result = await offload(play_local_file, filename, volume, False, 1, cls,
+                               on_event=job_registry.listener(job), trace=g.trace)
+        if result == COALESCED:
+            job_registry.update(job, COALESCED)
+        return jsonify({"status": result, "filename": filename, "job_id": job.id})
     except AudioPlaybackError as e:
     #except Exception as e:
+        job_registry.update(job, FAILED, str(e))
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/stream", methods=["POST"])
+async def stream():
+    # Either {"url": ...} as JSON, or the audio itself as the body with
+    # volume and priority as query parameters. Not traced or debounced
+    # by the decorators, those would read the whole body first.
+    trace = Trace("stream")
+    url = None
+    if request.mimetype == "application/json":
+        with span("parse"):
+            data = await request.get_json(force=True, silent=True)
+        if not data or "url" not in data:
+            return jsonify({"error": "Missing 'url'"}), 400
+        url = data["url"]
+        if urlparse(url).scheme not in ("http", "https"):
+            return jsonify({"error": "Only http and https urls are supported"}), 400
+    else:
+        data = request.args
+
+    try:
+        volume = float(data.get("volume", 100))
+    except ValueError:
+        return jsonify({"error": "Invalid 'volume'"}), 400
+
+    cls = request_class(data, TTS)
+    if cls is None:
+        return jsonify({"error": "Unknown 'priority'"}), 400
+
+    from decoder import StreamDecoder, PIPE
+    job = job_registry.create("stream")
+    try:
+        decoder = await offload(StreamDecoder, url or PIPE)
+    except OSError as e:
+        job_registry.update(job, FAILED, str(e))
+        return jsonify({"error": f"Cannot start decoder: {e}"}), 500
+
+    result = playback_scheduler.submit(cls, decoder, "stream", key=(url, volume) if url else None,
+                                       gain=volume_gain(volume), on_event=job_registry.listener(job),
+                                       trace=trace)
+    if result == COALESCED:
+        job_registry.update(job, COALESCED)
+
+    if url is None:
+        # Playback starts while the rest of the body is still arriving, the
+        # client is held back while the decoder is full
+        async for chunk in request.scope[RAW_BODY]:
+            # On the decoder's own thread, a slow stream must not hold one
+            # of the request threads while it plays
+            if not await asyncio.wrap_future(decoder.feed(chunk)):
+                break
+        await asyncio.wrap_future(decoder.feed_end())
+
+    return jsonify({"status": result, "job_id": job.id}), 202
+
+
+@app.route("/upload/<filename>", methods=["POST", "PUT"])
+async def upload(filename):
+    # Raw file in the body, e.g. curl --data-binary @chime.mp3
+    try:
+        validate_filename(filename)
+    except AudioPlaybackError as e:
         return jsonify({"error": str(e)}), 400
 
+    if os.path.isfile(os.path.join(AUDIO_DIR, filename)):
+        return jsonify({"error": "A shipped sound has this name"}), 409
+
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"error": "File too large"}), 413
+
+    # Stream into a temp file next to the target, the body is never held in memory
+    await offload(os.makedirs, MEDIA_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=MEDIA_DIR, suffix=".upload")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.body:
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise AudioPlaybackError("File too large")
+                await offload(f.write, chunk)
+    except BaseException as e:
+        os.unlink(tmp)
+        if isinstance(e, AudioPlaybackError):
+            return jsonify({"error": str(e)}), 413
+        raise
+
+    _LOGGER.debug("upload: %s, %d bytes", filename, size)
+
+    # Checked and transcoded in the background before it replaces
+    # anything, progress is available at /jobs/<id>
+    job = job_registry.create("upload")
+    executor.submit(upload_job, job, tmp, os.path.join(MEDIA_DIR, filename))
+
+    return jsonify({"status": "accepted", "filename": filename, "bytes": size, "job_id": job.id}), 202
+
+def upload_job(job, tmp, path):
+    job_registry.update(job, TRANSCODING)
+    try:
+        with span("decode"):
+            audio = decode_file(tmp)
+    except Exception as e:
+        # A sound of the same name stays as it was
+        _LOGGER.error("upload %s is no playable audio: %s", path, e)
+        os.unlink(tmp)
+        job_registry.update(job, FAILED, str(e))
+        return
+
+    try:
+        os.replace(tmp, path)
+    except OSError as e:
+        _LOGGER.error("upload %s failed: %s", path, e)
+        os.unlink(tmp)
+        job_registry.update(job, FAILED, str(e))
+        return
+
+    try:
+        # Writes the sidecar and puts the sound into the cache
+        store_local_file(path, audio)
+        audio_library.scan()
+        job_registry.update(job, DONE)
+    except AudioPlaybackError as e:
+        _LOGGER.error("upload %s failed: %s", path, e)
+        job_registry.update(job, FAILED, str(e))
+
+
+@app.route("/files", methods=["GET"])
+async def files():
+    # Clients send back the ETag and get a 304 while nothing changed
+    listing, etag = audio_library.files()
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response("", status=304)
+    else:
+        response = jsonify({"files": listing})
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+async def jobs(job_id):
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
 
 @app.route("/stop", methods=["GET"])
-def stop():
+async def stop():
+    # Only queues a command, never waits behind decoding or synthesis
     audio_controller.stop()
     return jsonify({"status": "stopped"})
 
 
 @app.route("/status", methods=["GET"])
-def status():
+async def status():
     is_running = audio_controller.status()
-    if is_running:
-        return jsonify({"status": "running"})
-    else:
-        return jsonify({"status": "stopped"})
+    return jsonify({
+        "status": "running" if is_running else "stopped",
+        "cache": audio_cache.stats(),
+        "tts_cache": tts_cache.stats(),
+        "warmup": warmup.status(),
+        "player": audio_controller.state(),
+        "scheduler": playback_scheduler.stats(),
+        "debounce": debouncer.stats(),
+        "library": audio_library.stats(),
+    })
     #return jsonify({"status": "playing"})
 
 
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    # Prometheus text format
+    cache, tts = audio_cache.stats(), tts_cache.stats()
+    player = audio_controller.state()
+    thread = audio_controller.thread
+
+    lines = stage_seconds.render() + first_audio_seconds.render()
+    lines += metric("doorbell_cache_hits_total", "counter", "Cache hits.",
+                    {'cache="audio"': cache["hits"], 'cache="tts"': tts["hits"]})
+    lines += metric("doorbell_cache_misses_total", "counter", "Cache misses.",
+                    {'cache="audio"': cache["misses"], 'cache="tts"': tts["misses"]})
+    lines += metric("doorbell_cache_hit_ratio", "gauge", "Cache hit ratio since start.",
+                    {'cache="audio"': cache["hit_ratio"], 'cache="tts"': tts["hit_ratio"]})
+    lines += metric("doorbell_cache_bytes", "gauge", "Bytes held by the cache.",
+                    {'cache="audio"': cache["bytes"], 'cache="tts"': tts["bytes"]})
+    lines += metric("doorbell_queue_depth", "gauge", "Items waiting to play.", {"": len(player["pending"])})
+    lines += metric("doorbell_commands_pending", "gauge", "Commands not yet taken by the playback thread.",
+                    {"": player["commands"]})
+    lines += metric("doorbell_voices", "gauge", "Sounds playing right now.", {"": len(player["voices"])})
+    lines += metric("doorbell_playback_thread_alive", "gauge", "1 while the playback thread runs.",
+                    {"": int(thread.is_alive())})
+    lines += metric("doorbell_playback_thread_cpu_seconds_total", "counter", "CPU time of the playback thread.",
+                    {"": thread_cpu_seconds(thread)})
+    lines += metric("doorbell_process_resident_memory_bytes", "gauge", "Resident memory of the add-on.",
+                    {"": process_rss()})
+    lines += metric("doorbell_startup_seconds", "gauge", "Seconds from the start of the add-on to each startup moment.",
+                    {f'moment="{name}"': seconds for name, seconds in startup_profile.report()["moments"].items()})
+
+    return "\n".join(lines) + "\n", 200, {"Content-Type": CONTENT_TYPE}
+
+
+@app.route("/startup", methods=["GET"])
+async def startup():
+    return jsonify(startup_profile.report())
+
+
 @app.route("/info", methods=["GET"])
-def info():
-    ipaddr = request.environ.get("SERVER_NAME")
+async def info():
+    ipaddr, port = request.scope.get("server") or (None, None)
     hostname = socket.gethostname()
-    port = request.environ.get("SERVER_PORT")
     return jsonify({"info": {"name": ADDON_SLUG,"host": hostname, "ip": ipaddr, "port": port}})
     #return jsonify({"status": "playing"})
 
 
 if __name__ == "__main__":
-    #app.run(host=HOST, port=PORT, debug=False, threaded=True)
-    serve(app, host=HOST, port=PORT)
+    audio_controller.start()
+    executor.submit(prepare_first_sound)
+    audio_library.start(LIBRARY_SCAN_INTERVAL)
+    if WARMUP:
+        warmup.start(WARMUP_WORKERS)
+    config = Config()
+    config.bind = [f"fd://{listen_fd}"]
+    asyncio.run(serve(app, config))
@@ -0,0 +1,135 @@
+import time
+import threading
+import logging
+from const import SCHEDULER_POLICIES, COALESCE_WINDOW, QUEUE_SIZE
+from controller import audio_controller, PREEMPT, QUEUE, MIX, SCHEDULE
+
+_LOGGER = logging.getLogger(__name__)
+
+# Request classes, highest priority first
+ALARM = "alarm"
+DOORBELL = "doorbell"
+TTS = "tts"
+AMBIENT = "ambient"
+
+PRIORITIES = {
+    ALARM: 3,
+    DOORBELL: 2,
+    TTS: 1,
+    AMBIENT: 0,
+}
+
+# What a request does when something else is already playing
+POLICY_PREEMPT = "preempt"   # interrupt playback of the same or lower priority
+POLICY_QUEUE = "queue"       # play after the current playback
+POLICY_MIX = "mix"           # play on top, lower priorities are ducked
+POLICY_DROP = "drop"         # ignore the request
+
+POLICIES = {POLICY_PREEMPT, POLICY_QUEUE, POLICY_MIX, POLICY_DROP}
+
+# Outcomes reported back to the caller
+ACCEPTED = "playing"
+COALESCED = "coalesced"
+
+
+class SchedulerError(Exception):
+    pass
+
+
+def parse_policies(text: str):
+    """Parse "alarm=preempt,tts=mix" into a dict."""
+    policies = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        request_class, _, policy = part.partition("=")
+        request_class, policy = request_class.strip(), policy.strip()
+        if request_class not in PRIORITIES or policy not in POLICIES:
+            raise SchedulerError(f"Invalid scheduler policy: {part}")
+        policies[request_class] = policy
+    return policies
+
+
+class PlaybackScheduler:
+    """Decides how a new request fits with what is already playing.
+
+    Requests carry a class (alarm > doorbell > tts > ambient). Identical
+    requests within the coalesce window are merged right away. The rest
+    is resolved by the playback worker when it takes the request from its
+    command queue, so bursts are handled in arrival order against the
+    real playback state: each request becomes a preempt, queue or mix
+    command according to the policy of its class, or is dropped.
+    """
+
+    def __init__(self, controller, policies, coalesce_window: float, max_queue: int):
+        self.controller = controller
+        self.policies = policies
+        self.coalesce_window = coalesce_window
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.recent = {}
+        self.counters = {COALESCED: 0, PREEMPT: 0, QUEUE: 0, MIX: 0, "dropped": 0}
+        controller.scheduler = self
+
+    def _coalesce(self, key) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            # Forget keys outside the window so the dict stays small
+            self.recent = {k: t for k, t in self.recent.items() if now - t < self.coalesce_window}
+            if key in self.recent:
+                return True
+            self.recent[key] = now
+            return False
+
+    def _count(self, outcome):
+        with self.lock:
+            self.counters[outcome] += 1
+
+    def submit(self, request_class: str, source, name: str="", key=None, gain: float=1.0, on_event=None, trace=None) -> str:
+        if request_class not in PRIORITIES:
+            raise SchedulerError(f"Unknown priority class: {request_class}")
+
+        if key is not None and self._coalesce((request_class, key)):
+            _LOGGER.debug("scheduler: coalesced %s", name)
+            if hasattr(source, "close"):
+                source.close()
+            self._count(COALESCED)
+            return COALESCED
+
+        policy = self.policies.get(request_class, POLICY_PREEMPT)
+        self.controller.submit(SCHEDULE, source, name, PRIORITIES[request_class], gain, policy, on_event, trace)
+        return ACCEPTED
+
+    def resolve(self, item, top, pending):
+        """Called by the playback worker, returns the command for item or None to drop it.
+
+        top is the highest priority playing (None when idle), pending the
+        number of queued items.
+        """
+        if top is None:
+            kind = QUEUE
+        elif item.policy == POLICY_DROP:
+            kind = None
+        elif item.policy == POLICY_MIX:
+            kind = MIX
+        elif item.policy == POLICY_PREEMPT and item.priority >= top:
+            kind = PREEMPT
+        else:
+            # Queue behind playback that may not be interrupted
+            kind = QUEUE if pending < self.max_queue else None
+
+        _LOGGER.debug("scheduler: %s (%s) -> %s", item.name, item.policy, kind)
+        self._count(kind or "dropped")
+        return kind
+
+    def stats(self):
+        with self.lock:
+            return {"policies": dict(self.policies), **self.counters}
+
+
+playback_scheduler = PlaybackScheduler(
+    audio_controller,
+    parse_policies(SCHEDULER_POLICIES),
+    COALESCE_WINDOW,
+    QUEUE_SIZE
+)
@@ -0,0 +1,131 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from const import SEQUENCE_WORKERS, TTS_LANG, LOOP_BUFFER_BYTES
+from audio import AudioPlaybackError, validate_filename, open_local_file
+from controller import audio_controller
+from beepnoise import BeepNoise
+from pcm import render_repeats, silence, concatenate, to_output, OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_WIDTH
+from tts import stream_message
+from metrics import span
+
+_LOGGER = logging.getLogger(__name__)
+
+# Step types
+BEEP = "beep"
+TTS = "tts"
+PLAY = "play"
+SILENCE = "silence"
+
+# Everything is rendered into memory before it plays, keep it bounded
+MAX_STEPS = 20
+MAX_BEEPS = 20
+MAX_SILENCE_MS = 10000
+
+_pool = ThreadPoolExecutor(max_workers=SEQUENCE_WORKERS, thread_name_prefix="sequence")
+
+
+def _max_bytes() -> int:
+    # The controller stops playback after max_duration, rendering more is wasted
+    frames = int(audio_controller.max_duration * OUTPUT_RATE / 1000)
+    return min(frames * OUTPUT_CHANNELS * OUTPUT_WIDTH, LOOP_BUFFER_BYTES)
+
+
+def _parse_step(step):
+    if not isinstance(step, dict):
+        raise AudioPlaybackError("not an object")
+
+    kind = step.get("type")
+    if kind == BEEP:
+        number = int(step.get("number", 1))
+        if not 1 <= number <= MAX_BEEPS:
+            raise AudioPlaybackError(f"'number' must be between 1 and {MAX_BEEPS}")
+        # Silence between two beeps in milliseconds, on top of the beep's own pause
+        gap = float(step.get("gap", 0))
+        if not 0 <= gap <= MAX_SILENCE_MS:
+            raise AudioPlaybackError(f"'gap' must be between 0 and {MAX_SILENCE_MS} ms")
+        return {"type": BEEP, "number": number, "gap": gap}
+    if kind == TTS:
+        message = step.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise AudioPlaybackError("missing 'message'")
+        return {"type": TTS, "message": message}
+    if kind == PLAY:
+        filename = step.get("filename")
+        if not isinstance(filename, str):
+            raise AudioPlaybackError("missing 'filename'")
+        validate_filename(filename)
+        return {"type": PLAY, "filename": filename}
+    if kind == SILENCE:
+        duration = float(step.get("duration", 0))
+        if not 0 < duration <= MAX_SILENCE_MS:
+            raise AudioPlaybackError(f"'duration' must be between 0 and {MAX_SILENCE_MS} ms")
+        return {"type": SILENCE, "duration": duration}
+    raise AudioPlaybackError(f"unknown type {kind!r}")
+
+
+def parse_steps(steps):
+    """The steps of a request checked and with their defaults filled in.
+
+    Raises AudioPlaybackError on the first invalid step, before anything
+    is decoded or synthesized.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise AudioPlaybackError("'steps' must be a non-empty list")
+    if len(steps) > MAX_STEPS:
+        raise AudioPlaybackError(f"At most {MAX_STEPS} steps")
+
+    parsed = []
+    for index, step in enumerate(steps):
+        try:
+            parsed.append(_parse_step(step))
+        except (AudioPlaybackError, TypeError, ValueError) as e:
+            raise AudioPlaybackError(f"Step {index + 1}: {e}")
+
+    pauses = sum(step["duration"] for step in parsed if step["type"] == SILENCE)
+    if pauses > audio_controller.max_duration:
+        raise AudioPlaybackError(f"Silence steps add up to more than {audio_controller.max_duration} ms")
+    return parsed
+
+
+def _prepare(step, cache):
+    kind = step["type"]
+    if kind == BEEP:
+        return render_repeats(BeepNoise().pcm(), step["number"], step["gap"],
+                              audio_controller.max_duration, LOOP_BUFFER_BYTES)
+    if kind == TTS:
+        # The sentences of the message are synthesized in parallel as well
+        return concatenate(future.result() for future in stream_message(step["message"], TTS_LANG, cache))
+    if kind == PLAY:
+        return open_local_file(step["filename"])
+    return silence(step["duration"])
+
+
+def render_sequence(steps, cache):
+    """Prepare all steps at the same time and render them into one buffer.
+
+    Files are decoded (or come from the cache) and messages synthesized
+    in parallel, the result plays as a single item so nothing can get
+    between two steps. It is cut off where the controller would stop
+    playing it.
+    """
+    max_bytes = _max_bytes()
+    futures = [_pool.submit(_prepare, step, cache) for step in steps]
+    parts = []
+    size = 0
+    try:
+        for future in futures:
+            if size >= max_bytes:
+                # Would never be heard, the rest is not waited for
+                break
+            part = to_output(future.result())
+            parts.append(part)
+            size += len(part.raw_data)
+    finally:
+        # Only steps that did not start yet, a no-op once all are done
+        for future in futures:
+            future.cancel()
+
+    with span("sequence"):
+        audio = concatenate(parts, max_bytes)
+    _LOGGER.debug("sequence: %d steps, %d ms", len(steps), len(audio))
+    return audio
@@ -0,0 +1,126 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import tempfile
+from pcm import PcmBuffer, OUTPUT_FORMAT, decode_file
+
+_LOGGER = logging.getLogger(__name__)
+
+# Sidecar layout: fixed header followed by raw interleaved PCM
+#   magic, version, channels, sample width, frame rate,
+#   source size, source mtime (ns)
+HEADER = struct.Struct("<4sBBHIQq")
+MAGIC = b"DBPC"
+VERSION = 2
+
+
+class SidecarStore:
+    """Transcode-once store of raw PCM sidecars for the source audio files.
+
+    Every source file is decoded a single time, in the output format,
+    into a sidecar file in directory. Playback maps the sidecar into memory instead of decoding
+    again, so the decoded library lives in the page cache and not in the
+    python heap.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def sidecar_path(self, path: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(path).encode("utf8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pcm")
+
+    def _read_header(self, sidecar: str):
+        try:
+            with open(sidecar, "rb") as f:
+                header = f.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+
+        if len(header) != HEADER.size:
+            return None
+
+        magic, version, channels, sample_width, frame_rate, size, mtime = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            return None
+
+        return channels, sample_width, frame_rate, size, mtime
+
+    def is_current(self, path: str) -> bool:
+        header = self._read_header(self.sidecar_path(path))
+        if header is None:
+            return False
+        channels, sample_width, frame_rate, size, mtime = header
+        if (frame_rate, channels, sample_width) != OUTPUT_FORMAT:
+            # Output format changed in the configuration
+            return False
+        st = os.stat(path)
+        return size == st.st_size and mtime == st.st_mtime_ns
+
+    def transcode(self, path: str, audio=None):
+        """Decode path and write its sidecar, replacing a stale one.
+
+        audio are the samples of path in the output format if the caller
+        decoded it already.
+        """
+        st = os.stat(path)
+        if audio is None:
+            audio = decode_file(path)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        header = HEADER.pack(
+            MAGIC, VERSION,
+            audio.channels, audio.sample_width, audio.frame_rate,
+            st.st_size, st.st_mtime_ns
+        )
+
+        # Write to a temp file first so readers never see a partial sidecar
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(audio.raw_data)
+            os.replace(tmp, self.sidecar_path(path))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        _LOGGER.debug("sidecar: transcoded %s", path)
+
+    def ensure(self, path: str) -> bool:
+        """Make sure the sidecar of path is current, returns True if it was transcoded."""
+        if self.is_current(path):
+            return False
+        self.transcode(path)
+        return True
+
+    def load(self, path: str) -> PcmBuffer:
+        """Map the sidecar of path, transcoding it first if missing or stale."""
+        self.ensure(path)
+
+        sidecar = self.sidecar_path(path)
+        with open(sidecar, "rb") as f:
+            _, _, channels, sample_width, frame_rate, _, _ = HEADER.unpack(f.read(HEADER.size))
+            if os.fstat(f.fileno()).st_size == HEADER.size:
+                # Nothing to map, mmap refuses empty files
+                return PcmBuffer(b"", frame_rate, channels, sample_width)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return PcmBuffer(
+            memoryview(mm)[HEADER.size:],
+            frame_rate, channels, sample_width,
+            mapped=True
+        )
+
+    def purge(self, keep):
+        """Remove sidecars whose source is not in keep."""
+        if not os.path.isdir(self.directory):
+            return
+        wanted = {os.path.basename(self.sidecar_path(path)) for path in keep}
+        for name in os.listdir(self.directory):
+            if name.endswith(".pcm") and name not in wanted:
+                _LOGGER.debug("sidecar: removing orphan %s", name)
+                os.unlink(os.path.join(self.directory, name))
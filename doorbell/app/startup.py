@@ -0,0 +1,102 @@
+import os
+import time
+import socket
+import threading
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Moments of the startup, in the order they normally happen
+CONTAINER = "container"      # run.sh started, from ADDON_START
+PROCESS = "process"          # the python process was created
+INTERPRETER = "interpreter"  # the interpreter runs our code
+LISTENING = "listening"      # the API port accepts connections
+IMPORTS = "imports"          # the API module is loaded
+SERVING = "serving"          # requests are answered
+OUTPUT_OPEN = "output_open"  # the output device is open
+PLAYABLE = "playable"        # a ring would be heard right away
+
+# The report is logged once all of these are known
+REPORT_AFTER = (SERVING, PLAYABLE)
+
+
+def _process_start():
+    """Wall clock time the process was created, None without /proc."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    age = uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    return time.time() - max(age, 0)
+
+
+def _container_start():
+    # run.sh exports the time it started, seconds since the epoch
+    try:
+        return float(os.environ["ADDON_START"])
+    except (KeyError, ValueError):
+        return None
+
+
+class StartupProfile:
+    """Where the time goes between container start and the first playable sound.
+
+    Moments are wall clock timestamps, so the one taken by run.sh before
+    python runs can be compared with ours. The report gives them as
+    seconds since the earliest one known.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.marks = {}
+        self.reported = False
+        for name, at in ((CONTAINER, _container_start()), (PROCESS, _process_start())):
+            if at is not None:
+                self.marks[name] = at
+        self.mark(INTERPRETER)
+
+    def mark(self, name: str):
+        # Only the first time counts, e.g. the output is opened again after idling
+        with self.lock:
+            if name in self.marks:
+                return
+            self.marks[name] = time.time()
+            ready = not self.reported and all(moment in self.marks for moment in REPORT_AFTER)
+            if ready:
+                self.reported = True
+
+        if ready:
+            report = self.report()
+            _LOGGER.info("startup: %s", ", ".join(
+                f"{name} +{seconds * 1000:.0f} ms" for name, seconds in report["moments"].items()
+            ))
+
+    def listen(self, host: str, port: int, backlog: int=100) -> int:
+        """Bind the API port now and return its descriptor for hypercorn.
+
+        Connections made before the server runs wait in the backlog
+        instead of being refused, so the port is open while the rest of
+        the add-on is still being imported.
+        """
+        sock = socket.create_server((host, port), backlog=backlog)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.mark(LISTENING)
+        return sock.detach()
+
+    def report(self):
+        with self.lock:
+            marks = sorted(self.marks.items(), key=lambda mark: mark[1])
+
+        origin = marks[0][1]
+        return {
+            "origin": marks[0][0],
+            "moments": {name: round(at - origin, 4) for name, at in marks},
+            "complete": all(moment in dict(marks) for moment in REPORT_AFTER),
+        }
+
+
+startup_profile = StartupProfile()
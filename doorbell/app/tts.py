@@ -0,0 +1,89 @@
+import re
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from const import TTS_WORKERS
+from pico2wave import PicoTTS
+from pcm import to_output
+from metrics import span
+
+_LOGGER = logging.getLogger(__name__)
+
+# Long sentences are cut at clause boundaries beyond this many characters
+MAX_CHUNK_CHARS = 120
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+_CLAUSE_RE = re.compile(r"(?<=,)\s+")
+
+# pico2wave runs as a subprocess, threads are enough to overlap them
+_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+
+def split_message(message: str):
+    """Split message into sentences, and long sentences into clauses."""
+    chunks = []
+    for sentence in _SENTENCE_RE.split(message.strip()):
+        if len(sentence) <= MAX_CHUNK_CHARS:
+            chunks.append(sentence)
+            continue
+
+        current = ""
+        for clause in _CLAUSE_RE.split(sentence):
+            if current and len(current) + len(clause) + 1 > MAX_CHUNK_CHARS:
+                chunks.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}" if current else clause
+        if current:
+            chunks.append(current)
+
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _synth_chunk(text: str, voice: str, cache) -> AudioSegment:
+    picotts = PicoTTS(cache=cache)
+    picotts.voice = voice
+    with span("synthesis"):
+        wav = picotts.synth_wav(text)
+    with span("decode"):
+        # pico2wave writes 16 kHz mono
+        return to_output(AudioSegment.from_file(BytesIO(wav), format="wav"))
+
+
+class ChunkStream:
+    """Futures of the chunks of one message, in playback order."""
+
+    def __init__(self, futures):
+        self.futures = futures
+        self.index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index >= len(self.futures):
+            raise StopIteration
+        future = self.futures[self.index]
+        self.index += 1
+        return future
+
+    def close(self):
+        # Cancel the chunks that have not started yet
+        for future in self.futures:
+            future.cancel()
+
+
+def stream_message(message: str, voice: str, cache) -> ChunkStream:
+    """Synthesize message chunk by chunk on the worker pool.
+
+    Returns futures of the decoded chunks in order, the playback worker
+    plays each one as soon as it is ready while the following chunks are
+    still being synthesized.
+    """
+    futures = [
+        _pool.submit(_synth_chunk, chunk, voice, cache)
+        for chunk in split_message(message)
+    ]
+    _LOGGER.debug("tts: streaming %d chunks", len(futures))
+    return ChunkStream(futures)
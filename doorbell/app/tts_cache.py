@@ -0,0 +1,122 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from cache import LRUCache
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def engine_version(exe: str = "pico2wave") -> str:
+    """Identify the installed TTS engine, changes when the binary is updated."""
+    path = shutil.which(exe)
+    if path is None:
+        return exe
+    st = os.stat(path)
+    return f"{path}:{st.st_size}:{st.st_mtime_ns}"
+
+
+class TtsCache:
+    """Two tier cache of synthesized wav files.
+
+    Results are keyed by a hash of (text, voice, engine version). A small
+    in-memory LRU tier sits in front of a persistent directory tier whose
+    total size is bounded, oldest used files are removed first.
+    """
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.memory = LRUCache(memory_bytes)
+        self.lock = threading.Lock()
+        # Lookups of the cache as a whole, a disk hit is a hit even though
+        # the memory tier missed
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.engine = engine_version()
+
+    def key(self, text: str, voice: str) -> str:
+        h = hashlib.sha256()
+        for part in (text, voice, self.engine):
+            h.update(part.encode("utf8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".wav")
+
+    def get(self, text: str, voice: str):
+        key = self.key(text, voice)
+
+        wav = self.memory.get(key)
+        if wav is not None:
+            with self.lock:
+                self.hits += 1
+            return wav
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                wav = f.read()
+            # Touch so eviction sees it as recently used
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            self.disk_hits += 1
+        self.memory.put(key, wav)
+        return wav
+
+    def put(self, text: str, voice: str, wav: bytes):
+        key = self.key(text, voice)
+        self.memory.put(key, wav)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(wav)
+            os.replace(tmp, self._path(key))
+            self._evict()
+        except OSError as e:
+            _LOGGER.warning("tts cache: cannot write %s: %s", self.directory, e)
+
+    def _evict(self):
+        with self.lock:
+            files = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".wav"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+
+            files.sort()
+            while total > self.disk_bytes and files:
+                _, size, path = files.pop(0)
+                os.unlink(path)
+                total -= size
+                _LOGGER.debug("tts cache: evicted %s", path)
+
+    def stats(self):
+        memory = self.memory.stats()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": memory["entries"],
+                "bytes": memory["bytes"],
+                "max_bytes": memory["max_bytes"],
+                "evictions": memory["evictions"],
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_hits": memory["hits"],
+                "disk_hits": self.disk_hits,
+            }
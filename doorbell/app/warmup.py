@@ -0,0 +1,108 @@
+import time
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from const import AUDIO_DIR, MEDIA_DIR, SIDECAR
+from cache import file_key
+from pcm import PcmBuffer, decode_file
+from audio import audio_cache, sidecar_store, audio_library
+from library import find_audio_files
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _decode(path: str):
+    # Runs in a worker process, only plain data crosses the process boundary
+    if SIDECAR:
+        # The parent maps the sidecar, no need to ship the samples back
+        sidecar_store.ensure(path)
+        return None
+    audio = decode_file(path)
+    return audio.raw_data, audio.sample_width, audio.frame_rate, audio.channels
+
+
+class Warmup:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.enabled = False
+        self.ready = False
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.duration = None
+
+    def start(self, workers: int):
+        self.enabled = True
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(workers,),
+            daemon=True
+        )
+        self.thread.start()
+
+    def run(self, workers: int):
+        start_time = time.time()
+
+        files = []
+        for directory in (AUDIO_DIR, MEDIA_DIR):
+            try:
+                files.extend(find_audio_files(directory))
+            except OSError as e:
+                _LOGGER.warning("warmup: cannot list %s: %s", directory, e)
+
+        if SIDECAR:
+            try:
+                sidecar_store.purge(files)
+            except OSError as e:
+                _LOGGER.warning("warmup: cannot purge sidecars: %s", e)
+
+        with self.lock:
+            self.total = len(files)
+
+        _LOGGER.info("warmup: decoding %d files with %d workers", len(files), workers)
+
+        # Forking this process would copy locks held by the playback, output
+        # and library threads, the workers are forked from a clean server
+        context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(_decode, path): path for path in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                    if result is None:
+                        audio = sidecar_store.load(path)
+                    else:
+                        data, sample_width, frame_rate, channels = result
+                        audio = PcmBuffer(data, frame_rate, channels, sample_width)
+                    audio_cache.put(file_key(path), audio)
+                    # Decoded anyway, the library measures its loudness
+                    audio_library.decoded(path, audio)
+                    with self.lock:
+                        self.done += 1
+                except Exception as e:
+                    _LOGGER.warning("warmup: failed to decode %s: %s", path, e)
+                    with self.lock:
+                        self.failed += 1
+
+        with self.lock:
+            self.duration = round(time.time() - start_time, 3)
+            self.ready = True
+
+        _LOGGER.info("warmup: finished in %ss", self.duration)
+
+    def status(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "ready": self.ready,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "duration": self.duration,
+            }
+
+
+warmup = Warmup()
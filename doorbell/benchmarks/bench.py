@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Benchmarks of the audio hot paths of the add-on.
+
+Runs headless: playback goes to the null output backend, which consumes
+audio in real time, and a stub pico2wave is put on the PATH when the real
+one is missing.
+
+    python3 benchmarks/bench.py --output results.json
+    python3 benchmarks/bench.py --baseline baseline.json --threshold 0.2
+
+Results are medians in milliseconds. With --baseline every benchmark
+slower than the baseline by more than threshold is reported and the
+exit code is 1.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ADDON_DIR, "app")
+
+STUB_PICO2WAVE = """#!/usr/bin/env python3
+# Stand-in for pico2wave: 16 kHz mono tone, 60 ms per character
+import sys, wave, math
+out = sys.argv[sys.argv.index("-w") + 1]
+frames = 16000 * 60 // 1000 * len(sys.argv[-1])
+tone = b"".join(int(8000 * math.sin(i / 5)).to_bytes(2, "little", signed=True) for i in range(160))
+w = wave.open(out, "w")
+w.setparams((1, 2, 16000, 0, "NONE", "not compressed"))
+w.writeframes(tone * (frames // 160))
+w.close()
+"""
+
+TTS_MESSAGE = "Somebody is at the front door. Please open it."
+
+
+def setup_environment(workdir: str):
+    """Configure the app for a headless run, before any app module is imported."""
+    os.environ["OUTPUT_BACKEND"] = "null"
+    os.environ["SIDECAR"] = "false"
+    os.environ["WARMUP"] = "false"
+    os.environ["MEDIA_DIR"] = os.path.join(workdir, "media")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    os.environ.setdefault("LOG_LEVEL", "warning")
+
+    stub = shutil.which("pico2wave") is None
+    if stub:
+        bindir = os.path.join(workdir, "bin")
+        os.makedirs(bindir)
+        path = os.path.join(bindir, "pico2wave")
+        with open(path, "w") as f:
+            f.write(STUB_PICO2WAVE.replace("/usr/bin/env python3", sys.executable, 1))
+        os.chmod(path, 0o755)
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+
+    # AUDIO_DIR is relative to the add-on directory
+    os.chdir(ADDON_DIR)
+    sys.path.insert(0, APP_DIR)
+    return stub
+
+
+def measure(func, repeat: int, setup=None):
+    """Run func repeat times, returns the durations in seconds."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "mean_ms": round(statistics.fmean(times) * 1000, 4),
+        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 4),
+        "min_ms": round(times[0] * 1000, 4),
+    }
+
+
+def bench_beep(results, repeat):
+    from beepnoise import BeepNoise, render_tone
+
+    results["beep.wav_cold"] = summary(measure(lambda: BeepNoise().beep(), repeat, setup=render_tone.cache_clear))
+    results["beep.wav_cached"] = summary(measure(lambda: BeepNoise().beep(), repeat))
+    results["beep.pcm_cached"] = summary(measure(lambda: BeepNoise().pcm(), repeat))
+
+
+def bench_decode(results, repeat):
+    from pydub import AudioSegment
+    from const import AUDIO_DIR
+    from pcm import decode_file
+    from library import find_audio_files
+
+    for path in find_audio_files(AUDIO_DIR):
+        name = os.path.basename(path)
+        try:
+            results[f"decode.{name}"] = summary(measure(lambda: AudioSegment.from_file(path), repeat))
+            results[f"decode_output.{name}"] = summary(measure(lambda: decode_file(path), repeat))
+        except Exception as e:
+            # e.g. no ffmpeg for the mp3s
+            print(f"skipping {name}: {e}", file=sys.stderr)
+
+
+def bench_tts(results, repeat):
+    from pico2wave import PicoTTS
+    from tts import split_message
+
+    picotts = PicoTTS()
+    results["tts.synth_wav"] = summary(measure(lambda: picotts.synth_wav(TTS_MESSAGE), repeat))
+    first = split_message(TTS_MESSAGE)[0]
+    results["tts.synth_wav_first_chunk"] = summary(measure(lambda: picotts.synth_wav(first), repeat))
+
+
+def bench_volume(results, repeat):
+    from mixer import Mixer, volume_gain
+    from pcm import PcmBuffer, OUTPUT_RATE, OUTPUT_CHANNELS
+    from const import DUCK_GAIN
+
+    # Five seconds of a full scale square wave
+    frames = OUTPUT_RATE * 5
+    data = (b"\xff\x7f\x01\x80" * (frames * OUTPUT_CHANNELS // 2))
+    audio = PcmBuffer(data, OUTPUT_RATE, OUTPUT_CHANNELS, 2)
+    mixer = Mixer(DUCK_GAIN)
+    gain = volume_gain(80)
+
+    results["volume.gain_stage_5s"] = summary(measure(lambda: mixer.scale(audio, gain), repeat))
+    segment = audio.to_segment()
+    results["volume.audiosegment_5s"] = summary(measure(lambda: segment + (80 - 100), repeat))
+
+
+def bench_controller(results, repeat):
+    from controller import audio_controller, PLAY, PREEMPT
+    from output import NullOutput
+    from pcm import PcmBuffer, OUTPUT_RATE, OUTPUT_CHANNELS
+
+    class SignalingOutput(NullOutput):
+        """Null output that tells when a buffer starts or is stopped."""
+
+        def __init__(self):
+            super().__init__()
+            self.started = threading.Event()
+            self.stopped = threading.Event()
+
+        def play_buffer(self, *args, **kwargs):
+            playback = super().play_buffer(*args, **kwargs)
+            stop = playback.stop
+
+            def stopped():
+                stop()
+                self.stopped.set()
+            playback.stop = stopped
+
+            self.started.set()
+            return playback
+
+    sink = SignalingOutput()
+    # Replace the output only once the worker has opened its own
+    audio_controller.start()
+    audio_controller.ready.wait()
+    audio_controller.output = sink
+
+    # Long enough to still be playing when it gets stopped or preempted
+    audio = PcmBuffer(bytes(OUTPUT_RATE * OUTPUT_CHANNELS * 2 * 2), OUTPUT_RATE, OUTPUT_CHANNELS, 2)
+
+    def wait_idle():
+        audio_controller.stop()
+        while audio_controller.status():
+            time.sleep(0.001)
+        sink.started.clear()
+        sink.stopped.clear()
+
+    def start():
+        audio_controller.submit(PLAY, [audio], "bench")
+        sink.started.wait()
+
+    def playing():
+        wait_idle()
+        start()
+        sink.started.clear()
+
+    def stop():
+        audio_controller.stop()
+        sink.stopped.wait()
+
+    def preempt():
+        audio_controller.submit(PREEMPT, [audio], "bench")
+        sink.started.wait()
+
+    results["controller.start"] = summary(measure(start, repeat, setup=wait_idle))
+    results["controller.stop"] = summary(measure(stop, repeat, setup=playing))
+    results["controller.preempt"] = summary(measure(preempt, repeat, setup=playing))
+    wait_idle()
+
+
+BENCHMARKS = {
+    "beep": bench_beep,
+    "decode": bench_decode,
+    "tts": bench_tts,
+    "volume": bench_volume,
+    "controller": bench_controller,
+}
+
+
+def compare(results, baseline, threshold: float):
+    """Benchmarks slower than baseline by more than threshold, as (name, old, new)."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        change = result["median_ms"] / old["median_ms"] - 1 if old["median_ms"] else 0
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{name:40s} {old['median_ms']:10.3f} -> {result['median_ms']:10.3f} ms {change:+7.1%} {marker}")
+        if change > threshold:
+            regressions.append((name, old["median_ms"], result["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per benchmark")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    # Relative to where we were started, the setup changes directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stub = setup_environment(workdir)
+
+        results = {}
+        for name in args.only or BENCHMARKS:
+            BENCHMARKS[name](results, args.repeat)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "pico2wave_stub": stub,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = json.load(f)["results"]
+        if compare(results, baseline_results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,15 +11,36 @@ from homeassistant.exceptions import ConfigEntryAuthFailed, HomeAssistantError
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
 from .api import DoorbellClient
-from .const import DOMAIN, DEFAULT_PORT
+from .const import DOMAIN, DEFAULT_PORT, EVENT_JOB_FINISHED, JOB_POLL_INTERVAL, JOB_TIMEOUT
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS: list[str] = ["sensor", "button"]
 
+# Job states after which the add-on does nothing more for a job
+JOB_FINISHED = {"done", "stopped", "dropped", "coalesced", "failed"}
+
 class AuthError(Exception):
     pass
 
+async def _watch_job(hass: HomeAssistant, client: DoorbellClient, service: str, job_id: str) -> None:
+    """Poll a job of the add-on and fire EVENT_JOB_FINISHED once it is over."""
+    job: Dict[str, Any] = {"job_id": job_id, "state": "unknown"}
+    try:
+        async with asyncio.timeout(JOB_TIMEOUT):
+            while True:
+                job = await client.job(job_id)
+                if job.get("state") in JOB_FINISHED:
+                    break
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+    except TimeoutError:
+        _LOGGER.warning("doorbell job %s did not finish in time", job_id)
+    except Exception as err:
+        _LOGGER.warning("doorbell job %s could not be tracked: %s", job_id, err)
+
+    _LOGGER.debug("doorbell.%s job finished %s", service, job)
+    hass.bus.async_fire(EVENT_JOB_FINISHED, {"service": service, **job})
+
 async def async_setup(hass: HomeAssistant, config: Dict[str, Any]) -> bool:
     """Register domain-level services (available even without entries)."""
 
@@ -46,6 +67,8 @@ async def async_setup(hass: HomeAssistant, config: Dict[str, Any]) -> bool:
             elif svc == "beep":
                 #resp = await client.beep(int(call.data["number"]), int(call.data["volume"]))
                 resp = await client.beep(int(call.data["number"]), int(call.data.get("volume",100)))
+            elif svc == "sequence":
+                resp = await client.sequence(list(call.data["steps"]), int(call.data.get("volume",100)))
             elif svc == "stop":
                 resp = await client.stop()
             else:
@@ -55,6 +78,10 @@ async def async_setup(hass: HomeAssistant, config: Dict[str, Any]) -> bool:
                 raise HomeAssistantError(resp["error"])
             _LOGGER.debug("doorbell.%s -> %s", svc, resp)
 
+            # The add-on answers before playback ends, report completion separately
+            if "job_id" in resp:
+                hass.async_create_task(_watch_job(hass, client, svc, resp["job_id"]))
+
         except HomeAssistantError:
             raise
         except Exception as err:
@@ -74,6 +101,9 @@ async def async_setup(hass: HomeAssistant, config: Dict[str, Any]) -> bool:
     hass.services.async_register(
         DOMAIN, "beep", _handle_call
     )
+    hass.services.async_register(
+        DOMAIN, "sequence", _handle_call
+    )
     hass.services.async_register(
         DOMAIN, "stop", _handle_call
     )
@@ -1,7 +1,7 @@
 
 from __future__ import annotations
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 _LOGGER = logging.getLogger(__name__)
@@ -38,6 +38,10 @@ class DoorbellClient:
         _LOGGER.debug("info executed ...")
         return await self._get_json("/info")
 
+    async def job(self, job_id: str) -> Dict[str, Any]:
+        _LOGGER.debug("job executed ...")
+        return await self._get_json(f"/jobs/{job_id}")
+
     # POST actions
     async def tts(self, message: str, volume: int) -> Dict[str, Any]:
         _LOGGER.debug("tts executed ...")
@@ -53,4 +57,8 @@ class DoorbellClient:
 
     async def beep(self, number: int, volume: int) -> Dict[str, Any]:
         _LOGGER.debug("beep executed ...")
-        return await self._post_json("/beep", {"number": number, "volume": volume})
\ No newline at end of file
+        return await self._post_json("/beep", {"number": number, "volume": volume})
+
+    async def sequence(self, steps: List[Dict[str, Any]], volume: int) -> Dict[str, Any]:
+        _LOGGER.debug("sequence executed ...")
+        return await self._post_json("/sequence", {"steps": steps, "volume": volume})
\ No newline at end of file
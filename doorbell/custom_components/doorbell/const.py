@@ -1,3 +1,8 @@
 DOMAIN = "doorbell"
 ADDON_SLUG = "local_doorbell"
-DEFAULT_PORT = 5000
\ No newline at end of file
+DEFAULT_PORT = 5000
+
+# Fired when a tts/play job has finished playing on the add-on
+EVENT_JOB_FINISHED = "doorbell_job_finished"
+JOB_POLL_INTERVAL = 0.5
+JOB_TIMEOUT = 300
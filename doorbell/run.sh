@@ -3,6 +3,9 @@
 
 set -eo pipefail
 
+# Start of the add-on, the API reports its startup moments relative to this
+ADDON_START=$(date +%s.%N)
+
 echo "hello from doorbell!"
 
 bashio::log.info "Starting Example Config Copier add-on"
@@ -11,8 +14,11 @@ bashio::log.info "Starting Example Config Copier add-on"
 PRESERVE_CHANGES=$(bashio::config 'preserve_changes')
 VERBOSE=$(bashio::config 'verbose_logging')
 
+RSYNC_VERBOSE=""
 if [ "${VERBOSE}" = "true" ]; then
   bashio::log.info "preserve_changes=${PRESERVE_CHANGES}"
+  # Listing every file is slow on a large config folder, only when asked for
+  RSYNC_VERBOSE="-vv"
 fi
 
 SRC_DIR="/app/homeassistant/doorbell"
@@ -36,11 +42,11 @@ fi
 if [ "${PRESERVE_CHANGES}" = "true" ]; then
   bashio::log.info "Preserving existing files in ${DST_DIR} (no overwrite)"
   # Use rsync to copy only files that don't exist or are newer in source
-  rsync -a -vv --ignore-existing --no-perms --no-owner --no-group "${SRC_DIR}/" "${DST_DIR}/"
+  rsync -a ${RSYNC_VERBOSE} --ignore-existing --no-perms --no-owner --no-group "${SRC_DIR}/" "${DST_DIR}/"
 else
   bashio::log.info "Copying files from ${SRC_DIR} to ${DST_DIR} (overwriting existing files)"
   # Use rsync to mirror the data directory into /config, overwrite by default
-  rsync -a -vv --delete --no-perms --no-owner --no-group "${SRC_DIR}/" "${DST_DIR}/"
+  rsync -a ${RSYNC_VERBOSE} --delete --no-perms --no-owner --no-group "${SRC_DIR}/" "${DST_DIR}/"
 fi
 
 # Optionally set a marker file with timestamp to indicate last copy
@@ -59,22 +65,27 @@ bashio::log.info "Config copy completed"
 
 declare config
 
-bashio::log.info "doing discovery ..."
+# Discovery waits for the supervisor, run it alongside the API startup
+# instead of before it
+discovery() {
+  bashio::log.info "doing discovery ..."
 
+  bashio::log.info "$(bashio::addon.hostname)"
+  bashio::log.info "$(bashio::addon.port 5000)"
+  bashio::log.info "$(bashio::config 'port')"
 
-bashio::log.info "$(bashio::addon.hostname)"
-bashio::log.info "$(bashio::addon.port 5000)"
-bashio::log.info "$(bashio::config 'port')"
+  config=$(bashio::var.json \
+      host "$(bashio::addon.hostname)" \
+      port2 "^8081" \
+      port "$(bashio::config 'port')" \
+      firmware "12345" \
+  )
 
-config=$(bashio::var.json \
-    host "$(bashio::addon.hostname)" \
-    port2 "^8081" \
-    port "$(bashio::config 'port')" \
-    firmware "12345" \
-)
+  bashio::discovery "doorbell" "${config}" > /dev/null || bashio::log.warning "Discovery failed"
+  #bashio::log.info "Published discovery: host=my_example_addon port=${PORT}"
+}
 
-bashio::discovery "doorbell" "${config}" > /dev/null
-#bashio::log.info "Published discovery: host=my_example_addon port=${PORT}"
+discovery &
 
 bashio::log.info "setting env variables ..."
 
@@ -83,6 +94,22 @@ CONF_HOST=$(bashio::config 'host')
 CONF_PORT=$(bashio::addon.port 5000)
 LOG_LEVEL=$(bashio::config 'log_level')
 TTS_LANG=$(bashio::config 'tts_lang')
+AUDIO_CACHE_MB=$(bashio::config 'audio_cache_mb')
+SIDECAR=$(bashio::config 'sidecar')
+TTS_CACHE_MB=$(bashio::config 'tts_cache_mb')
+TTS_STREAMING=$(bashio::config 'tts_streaming')
+SCHEDULER_POLICIES=$(bashio::config 'scheduler_policies')
+COALESCE_WINDOW_MS=$(bashio::config 'coalesce_window_ms')
+QUEUE_SIZE=$(bashio::config 'queue_size')
+DEBOUNCE_WINDOWS=$(bashio::config 'debounce_windows')
+UPLOAD_MAX_MB=$(bashio::config 'upload_max_mb')
+WARMUP=$(bashio::config 'warmup')
+WARMUP_WORKERS=$(bashio::config 'warmup_workers')
+OUTPUT_RATE=$(bashio::config 'output_rate')
+OUTPUT_CHANNELS=$(bashio::config 'output_channels')
+OUTPUT_BACKEND=$(bashio::config 'output_backend')
+OUTPUT_PERIOD_FRAMES=$(bashio::config 'output_period_frames')
+OUTPUT_IDLE_TIMEOUT=$(bashio::config 'output_idle_timeout')
 
 bashio::log.info "Starting API on ${CONF_HOST}:${CONF_PORT}"
 
@@ -90,6 +117,23 @@ export API_HOST="${CONF_HOST}"
 export API_PORT="${CONF_PORT}"
 export LOG_LEVEL="${LOG_LEVEL}"
 export TTS_LANG="${TTS_LANG}"
+export AUDIO_CACHE_MB="${AUDIO_CACHE_MB}"
+export SIDECAR="${SIDECAR}"
+export TTS_CACHE_MB="${TTS_CACHE_MB}"
+export TTS_STREAMING="${TTS_STREAMING}"
+export SCHEDULER_POLICIES="${SCHEDULER_POLICIES}"
+export COALESCE_WINDOW_MS="${COALESCE_WINDOW_MS}"
+export QUEUE_SIZE="${QUEUE_SIZE}"
+export DEBOUNCE_WINDOWS="${DEBOUNCE_WINDOWS}"
+export UPLOAD_MAX_MB="${UPLOAD_MAX_MB}"
+export WARMUP="${WARMUP}"
+export WARMUP_WORKERS="${WARMUP_WORKERS}"
+export OUTPUT_RATE="${OUTPUT_RATE}"
+export OUTPUT_CHANNELS="${OUTPUT_CHANNELS}"
+export OUTPUT_BACKEND="${OUTPUT_BACKEND}"
+export OUTPUT_PERIOD_FRAMES="${OUTPUT_PERIOD_FRAMES}"
+export OUTPUT_IDLE_TIMEOUT="${OUTPUT_IDLE_TIMEOUT}"
+export ADDON_START="${ADDON_START}"
 
 
 bashio::log.info "starting up ..."